@@ -1,21 +1,99 @@
-import sys
+import sys, os
 import csv
 import argparse
 from pathlib import Path
 import tifffile
 import numpy as np
-import fnmatch
 import re
+import queue, threading
+import functools
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import repeat
+from scan_common import compile_patterns, iter_dirs
 
-def find_crop_box(cropped_img_array, crop_color):
-    # Ensure crop_color has same dtype as image array
-    crop_color = np.array([np.array([c], dtype=cropped_img_array.dtype)[0] for c in crop_color], dtype=cropped_img_array.dtype)
-    mask = np.all(cropped_img_array == crop_color, axis=-1)
-    if not np.any(mask):
+#Crop data suffix added to filenames by renaming
+crop_suffix_pattern = re.compile(r"_C\d+-\d+-\d+-\d+")
+
+#Threads tifffile may use to decode compressed image segments (None -> tifffile default, one per core)
+decode_workers = None
+
+def init_worker():
+    #files are already spread across worker processes -> keep decoding single-threaded to avoid oversubscription
+    global decode_workers
+    decode_workers = 1
+
+@functools.lru_cache(maxsize=8)
+def check_crop_color(dtype, crop_color):
+    # Validity of crop_color depends only on image dtype -> check once per dtype, returns error message or None
+    if not np.issubdtype(dtype, np.integer):
+        return f"Unsupported image dtype: {dtype}. Only integer TIFFs (8/16-bit) are supported."
+    max_value = np.iinfo(dtype).max
+    if not all(0 <= c <= max_value for c in crop_color):
+        return f"crop-color {crop_color} out of range for {dtype} (0..{max_value}), error"
+    return None
+
+@functools.lru_cache(maxsize=8)
+def prepare_crop_color(dtype, crop_color):
+    # Cast crop_color to image dtype once per dtype (consecutive images usually share it)
+    return np.asarray(crop_color, dtype=dtype)
+
+@functools.lru_cache(maxsize=8)
+def mask_matcher(dtype, channels, crop_color):
+    # Build mask function specialized for (dtype, channels, crop_color) once: branch selection and
+    # color constants are resolved here instead of on every block of every image
+    color = prepare_crop_color(dtype, crop_color)
+    if channels == 1:
+        value = color[0]
+        return lambda img_array: img_array == value
+    if not color.any():
+        #black mask (the common case) -> OR channels together and compare with zero once
+        def match_black(img_array):
+            combined = img_array[..., 0] | img_array[..., 1]
+            for channel in range(2, channels):
+                combined |= img_array[..., channel]
+            return combined == 0
+        return match_black
+    values = tuple(color)
+    def match_color(img_array):
+        # Compare channel by channel into a single HxW mask (no HxWx3 temporary and no extra reduction pass)
+        mask = img_array[..., 0] == values[0]
+        for channel in range(1, channels):
+            mask &= img_array[..., channel] == values[channel]
+        return mask
+    return match_color
+
+def find_crop_box(cropped_img_array, crop_color, block_size=64):
+    channels = cropped_img_array.shape[2] if cropped_img_array.ndim == 3 else 1
+    match_mask = mask_matcher(cropped_img_array.dtype, channels, tuple(crop_color))
+    # Scan from each edge inwards in small blocks and stop at the first hit, so only the margins
+    # (plus rows between top and bottom for the column search) are ever compared
+    img_height, img_width = cropped_img_array.shape[:2]
+    #top: first row containing crop color
+    for y in range(0, img_height, block_size):
+        row_hits = match_mask(cropped_img_array[y:y + block_size]).any(axis=1)
+        if row_hits.any():
+            top = y + int(row_hits.argmax())
+            break
+    else:
         return None
-    ys, xs = np.where(mask)
-    top, bottom = ys.min(), ys.max()
-    left, right = xs.min(), xs.max()
+    #bottom: last row containing crop color (the row at top guarantees a hit)
+    for y in range(img_height, top, -block_size):
+        row_hits = match_mask(cropped_img_array[max(y - block_size, top):y]).any(axis=1)
+        if row_hits.any():
+            bottom = y - 1 - int(row_hits[::-1].argmax())
+            break
+    #left and right: first and last column containing crop color within found rows
+    rows = cropped_img_array[top:bottom + 1]
+    for x in range(0, img_width, block_size):
+        col_hits = match_mask(rows[:, x:x + block_size]).any(axis=0)
+        if col_hits.any():
+            left = x + int(col_hits.argmax())
+            break
+    for x in range(img_width, left, -block_size):
+        col_hits = match_mask(rows[:, max(x - block_size, left):x]).any(axis=0)
+        if col_hits.any():
+            right = x - 1 - int(col_hits[::-1].argmax())
+            break
     width = right - left + 1
     height = bottom - top + 1
     return left, top, width, height
@@ -24,114 +102,136 @@ def resolve_path(base: Path, path_str: str) -> Path:
     p = Path(path_str)
     return p if p.is_absolute() else (base / p).resolve()
 
-def match_patterns(filename, patterns):
-    return any(fnmatch.fnmatchcase(filename, pattern) for pattern in patterns)
-
-def iter_files(base_dir: Path, patterns, depth):
-    for path in base_dir.rglob("*"):
-        if path.is_file() and match_patterns(path.name, patterns):
-            relative_parts = path.relative_to(base_dir).parts
-            if depth >= 0 and len(relative_parts) - 1 > depth:
-                continue
-            yield path
+def iter_files(base_dir: Path, file_pattern, depth):
+    #yields (path, relative_path) string pairs, relative path uses '/' separators regardless of platform
+    for directory, relative_dir, _, filenames in iter_dirs(base_dir, file_pattern, depth):
+        directory = os.fspath(directory)
+        prefix = relative_dir.as_posix() + "/" if relative_dir.parts else ""
+        for filename in filenames:
+            yield os.path.join(directory, filename), prefix + filename
 
-def process_directory(base_dir, crop_color, depth, check_multiple, file_patterns):
-    crop_data = []
-    processed_dirs = set()
-    for path in iter_files(base_dir, file_patterns, depth):
-        relative_parts = path.relative_to(base_dir).parts
-        current_dir = Path(*relative_parts[:-1])
-        if current_dir not in processed_dirs:
-            print(f"Processing directory: {current_dir.as_posix() or '.'}")
-            processed_dirs.add(current_dir)
-
-        relative_path = path.relative_to(base_dir).as_posix()
-        print(f"{relative_path}: ", end="")
+def readahead(path):
+    #ask the kernel to start loading the file into page cache asynchronously (no-op where posix_fadvise is unavailable)
+    if not hasattr(os, "posix_fadvise"):
+        return
+    try:
+        fd = os.open(path, os.O_RDONLY)
         try:
-            cropped_array = tifffile.imread(path)
-
-            #Check image channels and validate crop_color length
-            if cropped_array.ndim == 2:
-                #grayscale
-                if len(crop_color) != 1:
-                    status = "error"
-                    print(f"Grayscale image, crop-color must be single integer. Skipping {relative_path}")
-                    crop_data.append([f"{relative_path}", -1, -1, -1, -1, status])
-                    continue
-            elif cropped_array.ndim == 3 and cropped_array.shape[2] == 3:
-                #RGB
-                if len(crop_color) != 3:
-                    status = "error"
-                    print(f"RGB image, crop-color must be three integers. Skipping {relative_path}")
-                    crop_data.append([f"{relative_path}", -1, -1, -1, -1, status])
-                    continue
-            else:
-                #unknown
-                status = "error"
-                print("not a 3-channel RGB image!")
-                crop_data.append([f"{relative_path}", -1, -1, -1, -1, status])
-                continue
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        finally:
+            os.close(fd)
+    except OSError:
+        pass
 
-            #Validate crop_color against dtype range for this image
-            dtype = cropped_array.dtype
-            if not np.issubdtype(dtype, np.integer):
-                status = "error"
-                print(f"Unsupported image dtype: {dtype}. Only integer TIFFs (8/16-bit) are supported.")
-                crop_data.append([f"{relative_path}", -1, -1, -1, -1, status])
-                continue
-            max_value = np.iinfo(dtype).max
-            if not all(0 <= c <= max_value for c in crop_color):
-                status = "error"
-                print(f"crop-color {crop_color} out of range for {dtype} (0..{max_value}), error")
-                crop_data.append([f"{relative_path}", -1, -1, -1, -1, status])
-                continue
+def load_image(path):
+    #uncompressed TIFFs are memory-mapped, so the crop box search only reads the parts of the file it touches
+    try:
+        return tifffile.memmap(path, mode="r")
+    except ValueError:
+        return tifffile.imread(path, maxworkers=decode_workers)
 
-            crop_box = find_crop_box(cropped_array, crop_color)
-            if not crop_box:
-                status = "!found"
-                print("no crop area found!")
-                crop_data.append([f"{relative_path}", -1, -1, -1, -1, status])
-                continue
+def prefetch_images(paths, prefetch=2, readahead_files=4):
+    #read images in a background thread (libtiff decode releases the GIL) while the caller searches the previous one
+    images = queue.Queue(maxsize=prefetch)
+    def producer():
+        for path in paths[:readahead_files]:
+            readahead(path)
+        for i, path in enumerate(paths):
+            if i + readahead_files < len(paths):
+                readahead(paths[i + readahead_files])
+            try:
+                images.put((path, load_image(path)))
+            except Exception as e:
+                images.put((path, e))
+    threading.Thread(target=producer, daemon=True).start()
+    for _ in paths:
+        yield images.get()
 
-            left, top, width, height = crop_box
-            if width % check_multiple != 0 or height % check_multiple != 0:
-                status = f"!mult{check_multiple}"
-            else:
-                status = "ok"
-            print(f"crop area found ({left}, {top}, {width}, {height}), {status}")
-            crop_data.append([f"{relative_path}", left, top, width, height, status])
-        except Exception as e:
-            print(f"error: {e}")
-            crop_data.append([f"{relative_path}", -1, -1, -1, -1, "error"])
-    return crop_data
+def process_file(path, relative_path, crop_color, check_multiple, cropped_array=None):
+    try:
+        if cropped_array is None: cropped_array = load_image(path)
+        elif isinstance(cropped_array, Exception): raise cropped_array
+
+        #Check image channels and validate crop_color length
+        if cropped_array.ndim == 2:
+            #grayscale
+            if len(crop_color) != 1:
+                return [f"{relative_path}", -1, -1, -1, -1, "error"], f"Grayscale image, crop-color must be single integer. Skipping {relative_path}"
+        elif cropped_array.ndim == 3 and cropped_array.shape[2] == 3:
+            #RGB
+            if len(crop_color) != 3:
+                return [f"{relative_path}", -1, -1, -1, -1, "error"], f"RGB image, crop-color must be three integers. Skipping {relative_path}"
+        else:
+            #unknown
+            return [f"{relative_path}", -1, -1, -1, -1, "error"], "not a 3-channel RGB image!"
+
+        #Validate crop_color against dtype range for this image
+        error = check_crop_color(cropped_array.dtype, crop_color)
+        if error is not None:
+            return [f"{relative_path}", -1, -1, -1, -1, "error"], error
+
+        crop_box = find_crop_box(cropped_array, crop_color)
+        if not crop_box:
+            return [f"{relative_path}", -1, -1, -1, -1, "!found"], "no crop area found!"
+
+        left, top, width, height = crop_box
+        if width % check_multiple != 0 or height % check_multiple != 0:
+            status = f"!mult{check_multiple}"
+        else:
+            status = "ok"
+        return [f"{relative_path}", left, top, width, height, status], f"crop area found ({left}, {top}, {width}, {height}), {status}"
+    except Exception as e:
+        return [f"{relative_path}", -1, -1, -1, -1, "error"], f"error: {e}"
+
+def process_directory(base_dir, crop_color, depth, check_multiple, file_pattern, workers=1):
+    crop_data = []
+    processed_dirs = set()
+    files = list(iter_files(base_dir, file_pattern, depth))
+    paths = [path for path, _ in files]
+    relative_paths = [relative_path for _, relative_path in files]
+    #files are independent -> decode and search them in worker processes, results come back in input order
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=init_worker) if workers > 1 and len(paths) > 1 else None
+    try:
+        if executor is not None:
+            results = executor.map(process_file, paths, relative_paths, repeat(crop_color), repeat(check_multiple))
+        else:
+            results = (process_file(path, relative_path, crop_color, check_multiple, image) for (path, image), relative_path in zip(prefetch_images(paths), relative_paths))
+        for relative_path, (row, message) in zip(relative_paths, results):
+            current_dir = relative_path.rpartition("/")[0]
+            if current_dir not in processed_dirs:
+                print(f"Processing directory: {current_dir or '.'}")
+                processed_dirs.add(current_dir)
+            print(f"{row[0]}: {message}")
+            crop_data.append(row)
+    finally:
+        if executor is not None: executor.shutdown()
+    return crop_data, files
 
 def write_csv(csv_path, crop_data):
-    with open(csv_path, mode="w", newline="") as f:
+    #1 MiB buffer -> rows are encoded into memory and hit the disk in a few large writes
+    with open(csv_path, mode="w", newline="", buffering=1 << 20) as f:
         writer = csv.writer(f, quoting=csv.QUOTE_NONNUMERIC)
         writer.writerow(["file", "left", "top", "width", "height", "status"])
         writer.writerows(crop_data)
     print(f"Crop data written to: {csv_path}")
 
-def rename_files_from_data(rename_dir: Path, crop_data, file_patterns, depth):
-    all_files = [f for f in iter_files(rename_dir, file_patterns, depth)]
+def plan_renames(files, crop_data):
+    #validate crop data and build new names for all files in one pass, leaving only rename syscalls for later
     crop_dict = {row[0]: row for row in crop_data}
-    for file_path in all_files:
-        relative_path = file_path.relative_to(rename_dir).as_posix()
-        if relative_path not in crop_dict:
+    plan = []
+    for file_path, relative_path in files:
+        row = crop_dict.get(relative_path)
+        if row is None:
             print(f"{relative_path} : no crop data found!")
             continue
-        row = crop_dict[relative_path]
         try:
             filename, left, top, width, height, status = row
-            if not all([left, top, width, height]):
+            if any(value in ('', None) for value in (left, top, width, height)):
                 print(f"{relative_path} : crop data incomplete!")
                 continue
 
             try:
-                left = int(left)
-                top = int(top)
-                width = int(width)
-                height = int(height)
+                left, top, width, height = int(left), int(top), int(width), int(height)
             except ValueError:
                 print(f"{relative_path} : invalid numeric data!")
                 continue
@@ -140,18 +240,36 @@ def rename_files_from_data(rename_dir: Path, crop_data, file_patterns, depth):
                 print(f"{relative_path} : invalid crop data! ({left},{top},{width},{height})")
                 continue
 
+            file_dir, file_name = os.path.split(file_path)
+            file_stem, file_ext = os.path.splitext(file_name)
             suffix = f"_C{left}-{top}-{width}-{height}"
-            if '__' not in file_path.stem:
+            if '__' not in file_stem:
                 suffix = '_' + suffix
-            new_name = file_path.stem + suffix + file_path.suffix
-            new_path = file_path.with_name(new_name)
-            file_path.rename(new_path)
-            msg = f"{file_path.name} → {new_name}"
+            new_name = file_stem + suffix + file_ext
+            msg = f"{file_name} → {new_name}"
             if status != "ok":
                 msg += f" [warning: status = {status}]"
-            print(msg)
+            plan.append((file_path, os.path.join(file_dir, new_name), relative_path, msg))
         except Exception as e:
             print(f"{relative_path} : error! {e}")
+    return plan
+
+def rename_files_from_data(rename_dir: Path, crop_data, file_pattern, depth, files=None):
+    #reuse (path, relative_path) list of already enumerated tree if provided
+    all_files = files if files is not None else [f for f in iter_files(rename_dir, file_pattern, depth)]
+    plan = plan_renames(all_files, crop_data)
+    #os.rename releases the GIL -> keep several renames in flight to hide filesystem metadata latency
+    def rename(item):
+        try:
+            os.rename(item[0], item[1])
+        except Exception as e:
+            return e
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        for (file_path, new_path, relative_path, msg), error in zip(plan, executor.map(rename, plan)):
+            if error is None:
+                print(msg)
+            else:
+                print(f"{relative_path} : error! {error}")
 
 def read_csv(csv_path):
     with open(csv_path, newline="") as f:
@@ -159,17 +277,20 @@ def read_csv(csv_path):
         headers = next(reader)
         return list(reader)
 
-def unname_files(rename_dir: Path, file_patterns, depth):
-    pattern = re.compile(r"_C\d+-\d+-\d+-\d+")
-    for file_path in iter_files(rename_dir, file_patterns, depth):
-        new_stem = pattern.sub("", file_path.stem)
-        if new_stem == file_path.stem:
+def unname_files(rename_dir: Path, file_pattern, depth):
+    for file_path, _ in iter_files(rename_dir, file_pattern, depth):
+        file_dir, file_name = os.path.split(file_path)
+        if not crop_suffix_pattern.search(file_name):
+            continue    #cheap pre-check, most files carry no crop data
+        file_stem, file_ext = os.path.splitext(file_name)
+        new_stem = crop_suffix_pattern.sub("", file_stem)
+        if new_stem == file_stem:
             continue
         if new_stem.endswith("_"):
             new_stem = new_stem[:-1]
-        new_path = file_path.with_name(new_stem + file_path.suffix)
-        file_path.rename(new_path)
-        print(f"{file_path.name} → {new_path.name}")
+        new_name = new_stem + file_ext
+        os.rename(file_path, os.path.join(file_dir, new_name))
+        print(f"{file_name} → {new_name}")
 
 def main():
     parser = argparse.ArgumentParser(description="Crop mask tool with optional rename and CSV export.")
@@ -182,14 +303,15 @@ def main():
     parser.add_argument("--crop-color", type=str, default="0,0,0", help="Color used for crop mask. Single integer for grayscale, comma-separated for RGB (default: 0,0,0). Use values consistent with image color depth")
     parser.add_argument("--check-multiple", type=int, default=8, help="Check that crop dimensions are multiple of this value (default: 8)")
     parser.add_argument("--wildcards", type=str, default="*.tif,*.tiff", help="Comma-separated list of file patterns to process (default: *.tif,*.tiff)")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 1) // 2), help="Number of worker processes [default: half the number of CPUs].")
 
     args = parser.parse_args()
     script_dir = Path(__file__).resolve().parent
-    file_patterns = [pat.strip() for pat in args.wildcards.split(",") if pat.strip()]
+    file_pattern = compile_patterns([pat.strip() for pat in args.wildcards.split(",") if pat.strip()])
 
     if args.unname:
         unname_dir = Path(args.unname) if args.unname is not True else Path.cwd()
-        unname_files(unname_dir, file_patterns, args.dirdepth)
+        unname_files(unname_dir, file_pattern, args.dirdepth)
         return
 
     if args.search:
@@ -206,7 +328,7 @@ def main():
             print("Error: --crop-color value must be positive integer(s) (decimal or 0x hex).")
             sys.exit(1)
 
-        crop_data = process_directory(search_dir, crop_color, args.dirdepth, args.check_multiple, file_patterns)
+        crop_data, files = process_directory(search_dir, crop_color, args.dirdepth, args.check_multiple, file_pattern, args.workers)
 
         if args.to_csv:
             csv_path = (search_dir / "crop.csv") if args.to_csv is True else resolve_path(search_dir, args.to_csv)
@@ -214,7 +336,9 @@ def main():
 
         if args.rename:
             rename_dir = Path(args.rename) if args.rename is not True else search_dir
-            rename_files_from_data(rename_dir, crop_data, file_patterns, args.dirdepth)
+            #same tree as searched -> no need to enumerate it again
+            if rename_dir.resolve() != search_dir.resolve(): files = None
+            rename_files_from_data(rename_dir, crop_data, file_pattern, args.dirdepth, files)
 
     elif args.from_csv:
         if not args.rename:
@@ -225,7 +349,7 @@ def main():
         csv_path = resolve_path(rename_dir, args.from_csv)
         crop_data = read_csv(csv_path)
         print(f"Loaded crop data from: {csv_path}")
-        rename_files_from_data(rename_dir, crop_data, file_patterns, args.dirdepth)
+        rename_files_from_data(rename_dir, crop_data, file_pattern, args.dirdepth)
     else:
         print("Error: --search or --from-csv is required.")
         sys.exit(1)
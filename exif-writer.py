@@ -1,22 +1,34 @@
 import sys, argparse
-import os, shutil, fnmatch
+import os, shutil
 from pathlib import Path
 import tifffile, numpy as np
-import subprocess, exiftool
 from datetime import datetime
 import time
 from zoneinfo import ZoneInfo
 from tzlocal import get_localzone_name
 from enum import Enum
-import locale, copy
+import locale
 import ast, re
 import html
+import functools, contextlib
+from collections import deque
+import scan_common
+from scan_common import compile_patterns, iter_dirs, exiftool_find, exiftool_get_helper, run_tasks
 
 _module_date = datetime(2025, 6, 25)
 _module_designer = "Alexander Taluts"
 
-#Exiftool path
-exiftool_exe = None
+#Persistent exiftool helper: no '-n' in common arguments (tag values are written with print conversion, reads that need numeric values request it themselves)
+scan_common.exiftool_helper_args['common_args'] = ['-G']
+
+#Number of threads tifffile uses to decode/encode an image (None - tifffile default)
+tifffile_workers = None
+
+#Local time zone, resolved on first use
+local_zone = None
+
+#Metadata file encoding (system preferred one)
+metafile_encoding_default = locale.getpreferredencoding(False)
 
 #Dictionary class for safe string formatting
 class SafeDict(dict):
@@ -26,6 +38,20 @@ class SafeDict(dict):
     def __missing__(self, key):
         return self._missing_value
 
+#Dictionary class for safe path formatting (metadata values are sanitized on first use only)
+class PathSafeDict(SafeDict):
+    def __init__(self, metadata, keys, max_value_length = None, missing_value = 'UNDEF'):
+        super().__init__(missing_value = missing_value)
+        self._metadata = metadata
+        self._keys = keys
+        self._max_value_length = max_value_length
+    def __missing__(self, key):
+        if key not in self._keys: return self._missing_value
+        metadata_key = self._keys[key]
+        value = path_sanitize_variable(metadata_key, self._metadata[metadata_key], max_length = self._max_value_length)
+        self[key] = value
+        return value
+
 #Marker options for tag values 
 class Marker(Enum):
     MANDATORY   = '<MANDATORY>'     #error will be raised if tag value won't be acquired
@@ -34,6 +60,9 @@ class Marker(Enum):
     SKIP        = '<SKIP>'          #tag will not be added (even if its value will be acquired) but will remain if already existed in the source file
     DELETE      = '<DELETE>'        #tag will be deleted
 
+#Markers by their value
+marker_by_value = {marker.value: marker for marker in Marker}
+
 #EXIF Flash values
 exif_flash_enum = {
     0:  "No Flash",                                                # 0x0
@@ -64,9 +93,10 @@ exif_flash_enum = {
     93: "Auto, Fired, Red-eye reduction, Return not detected",     # 0x5D
     95: "Auto, Fired, Red-eye reduction, Return detected",         # 0x5F
 }
-exif_flash_enum_fired = (1, 5, 7, 9, 25, 29, 31, 65, 69, 71, 73, 77, 79, 89, 93, 95)
-exif_flash_enum_notfired = (0, 8, 16, 20, 24, 88)
-exif_flash_enum_notpresent = (32, 48)
+exif_flash_enum_reverse = {value: key for key, value in exif_flash_enum.items()}
+exif_flash_enum_fired = frozenset((1, 5, 7, 9, 25, 29, 31, 65, 69, 71, 73, 77, 79, 89, 93, 95))
+exif_flash_enum_notfired = frozenset((0, 8, 16, 20, 24, 88))
+exif_flash_enum_notpresent = frozenset((32, 48))
 
 #EXIF Orientation values
 exif_orientation_enum = {
@@ -125,6 +155,19 @@ exif_gps_processingmethod_enum = {
     3: "MANUAL"
 }
 
+#Path sanitizing tables and regexes
+path_unsafe_chars_translation = str.maketrans(dict.fromkeys('<>:"/\\|?*' + ''.join(map(chr, range(0x20))), '_'))   #characters forbidden in path components
+path_drive_colon_regex        = re.compile(r'([A-Za-z]):(?=[\\/])')                                                #colon of a drive letter
+path_key_translation          = str.maketrans({':': "_cln_"})                                                      #metadata key to format field name
+
+#EXIF datetime format "YYYY:MM:DD hh:mm:ss"
+datetime_regex = re.compile(r"^\d{4}:\d{2}:\d{2} \d{2}:\d{2}:\d{2}$")
+
+#Literal value parsing
+literal_constants   = {'True': True, 'False': False, 'None': None}
+literal_int_regex   = re.compile(r'[+-]?(?:0+|[1-9][0-9]*)')                                                  #decimal integer (no leading zeros as in Python)
+literal_float_regex = re.compile(r'[+-]?(?:[0-9]+\.[0-9]*|\.[0-9]+)(?:[eE][+-]?[0-9]+)?|[+-]?[0-9]+[eE][+-]?[0-9]+')  #decimal float
+
 #metadata - default values
 metadata_default = {
     'Script:LockTagList'        : False,                        #n/a    : bool                              - lock tag list (only initial tags listed here are allowed to be in final metadata, addition of tags groups which will be stripped before writing to image file are allowed though)
@@ -197,45 +240,31 @@ metadata_default = {
     'Extra:StripID'             : "",                           #n/a    : string                            - film strip name/identifier
     'Extra:StripFrameNumber'    : 0,                            #n/a    : int                               - frame number on a film strip
 }
-
-#Get exiftool executable name
-def exiftool_getname():
-    return "exiftool.exe" if sys.platform.startswith("win") else "exiftool"
-
-#Find exiftool
-def exiftool_find(search_list: Path = None):
-    global exiftool_exe
-    #if already resolved -> do nothing
-    if exiftool_exe is not None: return
-
-    if isinstance(search_list, (tuple, list)): pass
-    elif isinstance(search_list, Path): search_list = [search_list]
-    else: search_list = []
-
-    #add script directory path to search list
-    search_list.append(Path(sys.argv[0]).resolve().parent) 
-
-    #search in the search list
-    for path in search_list:
-        if path.name != exiftool_getname():
-            path = path / exiftool_getname()
-        if path.is_file():
-            exiftool_exe = str(path)
-            return
-    
-    #search in system PATH
-    path = shutil.which("exiftool")
-    if path:
-        exiftool_exe = path
-        return
-
-    #not found
-    raise FileNotFoundError("ExifTool executable not found in manual path, script directory or system PATH.")
+#--- intern tag names: metadata dicts are copied from defaults and updated from metafiles with interned names too, so tag lookups mostly hit identity check
+metadata_default = {sys.intern(key): value for key, value in metadata_default.items()}
+
+#Get local time zone (resolved on first call)
+def timezone_get_local():
+    global local_zone
+    if local_zone is None:
+        local_zone = ZoneInfo(get_localzone_name())
+    return local_zone
+
+#Initialize worker process (files are processed in parallel, each worker drives its own persistent exiftool)
+def init_worker(exiftool_path):
+    global tifffile_workers
+    tifffile_workers = 1        #files are already spread across worker processes -> keep decoding/encoding single-threaded to avoid oversubscription
+    scan_common.init_worker(exiftool_path)
 
 #Convert string to an int
 def str2int(s, negative_prefix = 'm'):
     if not isinstance(s, str):
         raise ValueError("Input must be a string.")
+    try:
+        #plain number (the most common case)
+        return int(s)
+    except ValueError:
+        pass
     try:
         if s.startswith(negative_prefix):
             return -int(s[len(negative_prefix):])
@@ -248,7 +277,12 @@ def str2int(s, negative_prefix = 'm'):
 def str2float(s, negative_prefix='m', decimal_point = '.'):
     if not isinstance(s, str):
         raise ValueError("Input must be a string.")
-    s = s.replace(decimal_point, ".")
+    if decimal_point != '.': s = s.replace(decimal_point, ".")
+    try:
+        #plain number (the most common case)
+        return float(s)
+    except ValueError:
+        pass
     try:
         if s.startswith(negative_prefix):
             return -float(s[len(negative_prefix):])
@@ -257,9 +291,21 @@ def str2float(s, negative_prefix='m', decimal_point = '.'):
     except (ValueError, TypeError) as e:
         raise ValueError(f"Cannot convert '{s}' to float.") from e
 
+#Convert string to a Python literal value (plain numbers, constants and words without building AST), keep it as is if it's not a literal
+def str2literal(s):
+    if s in literal_constants: return literal_constants[s]
+    if s.isidentifier(): return s
+    if literal_int_regex.fullmatch(s): return int(s)
+    if literal_float_regex.fullmatch(s): return float(s)
+    try:
+        return ast.literal_eval(s)
+    except (ValueError, SyntaxError):
+        return s
+
 #Delete key with specified prefixes from the dictionary
 def delete_keys_with_prefixes(dictionary, prefixes):
-    keys_to_delete = [key for key in dictionary if any(key.startswith(prefix) for prefix in prefixes)]
+    prefixes = tuple(prefixes)
+    keys_to_delete = [key for key in dictionary if key.startswith(prefixes)]
     for key in keys_to_delete:
         del dictionary[key]
 
@@ -268,10 +314,14 @@ def path_sanitize_variable(key, value, max_length = None):
     #handle exceptions that should not be sanitized
     if key.startswith('Extra:File'): return value 
 
-    if isinstance(value, str):
-        #sanitize strings
-        result = re.sub(r'[<>:"/\\|?*\x00-\x1F]', '_', value.strip())
-        if max_length is not None: value = value[:max_length]
+    value_type = type(value)
+    if value_type is str or isinstance(value, str):
+        #sanitize strings (the most common case)
+        result = value.strip().translate(path_unsafe_chars_translation)
+        if max_length is not None: result = result[:max_length]
+    elif value_type in (int, float, bool):
+        #pass plain numbers as is
+        result = value
     elif value is None: 
         #sanitize None
         result = str(value)
@@ -289,15 +339,12 @@ def path_sanitize_variable(key, value, max_length = None):
 
 #Build a safe path using a template and metadata dictionary
 def path_build(path, metadata, max_total_length = None, max_value_length = None, missing_value='UNDEF'):
-    #sanitize and optionally truncate individual values
-    metadata_sanitized = {
-        k.replace(':', "_cln_"): path_sanitize_variable(k, v, max_length = max_value_length)
-        for k, v in metadata.items()
-    }
-    metadata_sanitized = SafeDict(metadata_sanitized, missing_value = missing_value)
+    #sanitize and optionally truncate individual values (only ones used in the path)
+    metadata_keys = {k.translate(path_key_translation): k for k in metadata}
+    metadata_sanitized = PathSafeDict(metadata, metadata_keys, max_value_length = max_value_length, missing_value = missing_value)
     #change special characters to match fstrings syntax
     #--- replace all ':' with substitute except one in drive letter 
-    path = re.sub(r'([A-Za-z]):(?=[\\/])', r'\1__DRIVELETTERCOLON__', str(path))
+    path = path_drive_colon_regex.sub(r'\1__DRIVELETTERCOLON__', str(path))
     path = path.replace(':', "_cln_")
     path = path.replace('__DRIVELETTERCOLON__', ":")
     #--- replace formatting delimiter
@@ -315,12 +362,24 @@ def path_build(path, metadata, max_total_length = None, max_value_length = None,
             path = path[:max_total_length]
     return path
 
+#Report a message (collected into a list if one is given, so worker processes don't print on their own)
+def report(message, messages = None):
+    if messages is None: print(message)
+    else: messages.append(message)
+
+#Write tags with persistent exiftool, its warnings (stderr) are reported the same way as script warnings
+def exiftool_write(args, messages = None):
+    exif = exiftool_get_helper()
+    result = exif.execute(*args)
+    for line in exif.last_stderr.splitlines():
+        if line.strip(): report(line.strip(), messages)
+    return result
+
 #Check if tag value can be written (updated)
 def tag_iswritable(tag_name, metadata):
-    if tag_name in metadata:
-        if metadata[tag_name] != Marker.SKIP and metadata[tag_name] != Marker.DELETE:
-            return True
-    return False
+    #missing tag is treated as skipped, markers are singletons so identity check is enough (values may be unhashable lists)
+    value = metadata.get(tag_name, Marker.SKIP)
+    return value is not Marker.SKIP and value is not Marker.DELETE
 
 #Check if flash was fired
 def exif_flash_fired(exif_flash_value):
@@ -328,18 +387,50 @@ def exif_flash_fired(exif_flash_value):
         if not exif_flash_value in exif_flash_enum:
             raise ValueError(f"Unknown EXIF Flash value '{exif_flash_value}'.")
     elif isinstance(exif_flash_value, str):
-        for key, value in exif_flash_enum.items():
-            if value == exif_flash_value:
-                exif_flash_value = key
-                break
-        else:
+        if not exif_flash_value in exif_flash_enum_reverse:
             raise ValueError(f"Unknown EXIF Flash value '{exif_flash_value}'.")
+        exif_flash_value = exif_flash_enum_reverse[exif_flash_value]
     else:
         raise ValueError(f"Invalid EXIF Flash value type '{exif_flash_value}'.")
     if exif_flash_value in exif_flash_enum_fired: return True
     if exif_flash_value in exif_flash_enum_notfired: return False
     if exif_flash_value in exif_flash_enum_notpresent: return False
 
+#Convert flat dict items with colon-separated keys into nested dict
+def nest_keys(items):
+    nested = {}
+    for key, value in items:
+        parts = key.split(':')
+        cur = nested
+        for part in parts[:-1]:
+            cur = cur.setdefault(part, {})
+        cur[parts[-1]] = value
+    return nested
+
+#Lay out lines of nested dict (walking it with explicit stack): block lines as strings, entry lines as (<prefix>, <leaf value>)
+def nested_dict_layout(nested, format_entry_postfix, format_value_delimiter, format_block_prefix, format_block_postfix, format_block_indent):
+    lines = []
+    stack = [(iter(nested.items()), '')]
+    while stack:
+        items, indent = stack[-1]
+        for key, value in items:
+            if isinstance(value, dict):
+                lines.append(f"{indent}{key}{format_value_delimiter}{format_block_prefix}")
+                if not value: lines.append('')      #empty block still gets its own (empty) line
+                stack.append((iter(value.items()), indent + format_block_indent))
+                break
+            lines.append((f"{indent}{key}{format_value_delimiter}", value))
+        else:
+            #block is over -> close it with the indent of its parent
+            stack.pop()
+            if stack: lines.append(f"{stack[-1][1]}{format_block_postfix}{format_entry_postfix}")
+    return lines
+
+#Lay out lines of nested dict for a sequence of flat keys, leaf values are indices of the keys (cached, the same keys repeat for every file)
+@functools.lru_cache(maxsize = 16)
+def nested_dict_layout_cached(keys, *format_args):
+    return tuple(nested_dict_layout(nest_keys((key, i) for i, key in enumerate(keys)), *format_args))
+
 #Format flat dictionary with nested key groups into a string
 def format_nested_dict(flat_dict,
                        format_entry_prefix='\n',
@@ -348,34 +439,17 @@ def format_nested_dict(flat_dict,
                        format_block_prefix='{',
                        format_block_postfix='}',
                        format_block_indent='    '):
-
-    def nest_keys(d):
-        """Converts flat dict with colon-separated keys into nested dict."""
-        nested = {}
-        for key, value in d.items():
-            parts = key.split(':')
-            cur = nested
-            for part in parts[:-1]:
-                cur = cur.setdefault(part, {})
-            cur[parts[-1]] = value
-        return nested
-
-    def render(d, indent=''):
-        lines = []
-        for key, value in d.items():
-            if isinstance(value, dict):
-                lines.append(f"{indent}{key}{format_value_delimiter}{format_block_prefix}")
-                lines.append(render(value, indent + format_block_indent))
-                lines.append(f"{indent}{format_block_postfix}{format_entry_postfix}")
-            else:
-                lines.append(f"{indent}{key}{format_value_delimiter}{value}{format_entry_postfix}")
-        return format_entry_prefix.join(lines)
-
-    nested = nest_keys(flat_dict)
-    return render(nested)
+    format_args = (format_entry_postfix, format_value_delimiter, format_block_prefix, format_block_postfix, format_block_indent)
+    values = tuple(flat_dict.values())
+    if any(isinstance(value, dict) for value in values):
+        #dict values turn into blocks themselves -> layout depends on values, build it from scratch
+        layout = nested_dict_layout(nest_keys(flat_dict.items()), *format_args)
+        return format_entry_prefix.join(line if isinstance(line, str) else f"{line[0]}{line[1]}{format_entry_postfix}" for line in layout)
+    layout = nested_dict_layout_cached(tuple(flat_dict), *format_args)
+    return format_entry_prefix.join(line if isinstance(line, str) else f"{line[0]}{values[line[1]]}{format_entry_postfix}" for line in layout)
 
 #Transform the image
-def image_transform(image, crop_left, crop_top, crop_width, crop_height, rotate_cw = None, flip_horizontal = None, flip_vertical = None):
+def image_transform(image, crop_left, crop_top, crop_width, crop_height, rotate_cw = None, flip_horizontal = None, flip_vertical = None, messages = None):
     #if width or height is 0 -> don't crop in that direction
     if crop_width  == 0: crop_width  = image.shape[1]
     if crop_height == 0: crop_height = image.shape[0]
@@ -386,92 +460,96 @@ def image_transform(image, crop_left, crop_top, crop_width, crop_height, rotate_
     if crop_left < 0 or crop_top < 0 or image.shape[0] < crop_top + crop_height or image.shape[1] < crop_left + crop_width:
         raise ValueError("Error! Crop region is outside image boundaries.")
     elif image.shape[0] == crop_top + crop_height and image.shape[1] == crop_left + crop_width:
-        print("Nothing to change.")
-
-    #crop
-    image_result = image[crop_top:crop_top + crop_height, crop_left:crop_left + crop_width]
+        report("Nothing to change.", messages)
 
-    #rotate
+    #rotate (as steps along source rows/columns and axes swap, same as np.rot90)
+    step_y, step_x, transpose = 1, 1, False
     if rotate_cw:
         if rotate_cw % 90 != 0:
             raise ValueError("Error! Rotate can only be performed by multiple of 90 degrees.")
         k = (-rotate_cw // 90) % 4
-        if k != 0:
-            image_result = np.rot90(image_result, k=k)
-
-    #flip
-    if flip_horizontal: image_result = np.fliplr(image_result)
-    if flip_vertical:   image_result = np.flipud(image_result)
-
-    return image_result
+        if k == 1:   step_x, transpose = -1, True
+        elif k == 2: step_y, step_x = -1, -1
+        elif k == 3: step_y, transpose = -1, True
+
+    #flip (axes of rotated image are swapped relative to source if transposed)
+    if flip_horizontal:
+        if transpose: step_y = -step_y
+        else:         step_x = -step_x
+    if flip_vertical:
+        if transpose: step_x = -step_x
+        else:         step_y = -step_y
+
+    #nothing to do -> return image as is (C-contiguous, as tifffile encoder expects it)
+    if crop_top == 0 and crop_left == 0 and crop_height == image.shape[0] and crop_width == image.shape[1] and step_y == 1 and step_x == 1 and not transpose:
+        return np.ascontiguousarray(image)
+
+    #crop, rotate and flip as a single strided view, then copy it once (no copy if view is C-contiguous already, e.g. crop of whole rows)
+    image_result = image[crop_top:crop_top + crop_height, crop_left:crop_left + crop_width][::step_y, ::step_x]
+    if transpose: image_result = image_result.swapaxes(0, 1)
+    return np.ascontiguousarray(image_result)
 
 #Get metadata from scanner
 def metadata_get_scanner(file_path):
     result = {}
-    with exiftool.ExifToolHelper(executable = exiftool_exe) as exif:
-        #Scanner model from 0x0110 'Model' and software from 0x0131 'Software'
-        output = exif.get_tags(file_path, ['Model', 'Software'])[0]
-        if 'EXIF:Model' in output: result['Scanner:Model'] = output['EXIF:Model']
-        if 'EXIF:Software' in output: result['Scanner:Software:Name'] = output['EXIF:Software']
-        
-        if 'Scanner:Model' in result and 'Scanner:Software:Name' in result:
-            if "nikon" in result['Scanner:Model'].lower() and 'nikon' in result['Scanner:Software:Name'].lower():
-                #NikonScanIFD from Nikon MakerNotes
-                output = exif.get_tags(file_path, 'NikonScan:all')[0]
-                for tag_name, value in output.items():
-                    if tag_name == 'SourceFile': continue  #skip this key entirely
-                    if tag_name.startswith('MakerNotes:'): tag_name = tag_name[len('MakerNotes:'):]  #remove prefix
-                    result['Scanner:Software:' + tag_name] = value
-
-                #fix NikonScan bug for negative gain values (negative values higher than they set in GUI by 0.01 )
-                if "Nikon Scan" in result['Scanner:Software:Name']:
-                    if 'Scanner:Software:MasterGain' in result:
-                        value = result['Scanner:Software:MasterGain']
-                        if value < 0: value -= 0.01
-                        result['Scanner:Software:MasterGain'] = format(value, "g")
-                    if 'Scanner:Software:ColorGain' in result:
-                        try:
-                            color_gain = [float(part) for part in result['Scanner:Software:ColorGain'].split()]
-                            result['Scanner:Software:ColorGain'] = ""
-                            for value in color_gain:
-                                if value < 0: value -= 0.01
-                                result['Scanner:Software:ColorGain'] += format(value, "g") + ', '
-                            result['Scanner:Software:ColorGain'] = result['Scanner:Software:ColorGain'].strip(', ')
-                        except ValueError:
-                            raise ValueError("Error! Can't parse NikonScan:ColorGain value.")        
-
-                #insert AutoExposure parameter (equals True by default)
-                if "Nikon Scan" in result['Scanner:Software:Name']:
-                    if 'Scanner:Software:MasterGain' in result:
-                        tmp = {}
-                        for tag_name, value in result.items():
-                            if tag_name == 'Scanner:Software:MasterGain': tmp['Scanner:Software:AutoExposure'] = True
-                            tmp[tag_name] = value
-                        result = tmp
+    exif = exiftool_get_helper()
+    #Scanner model from 0x0110 'Model', software from 0x0131 'Software' and NikonScanIFD from Nikon MakerNotes in a single request
+    output = exif.get_tags(file_path, ['Model', 'Software', 'NikonScan:all'], params = ['-n'])[0]
+    if 'EXIF:Model' in output: result['Scanner:Model'] = output['EXIF:Model']
+    if 'EXIF:Software' in output: result['Scanner:Software:Name'] = output['EXIF:Software']
+    
+    if 'Scanner:Model' in result and 'Scanner:Software:Name' in result:
+        if "nikon" in result['Scanner:Model'].lower() and 'nikon' in result['Scanner:Software:Name'].lower():
+            #NikonScanIFD from Nikon MakerNotes
+            for tag_name, value in output.items():
+                if not tag_name.startswith('MakerNotes:'): continue                     #skip SourceFile and EXIF tags
+                if tag_name in ('MakerNotes:Model', 'MakerNotes:Software'): continue    #skip non-NikonScan matches of generic tags
+                tag_name = tag_name[len('MakerNotes:'):]  #remove prefix
+                result['Scanner:Software:' + tag_name] = value
+
+            #fix NikonScan bug for negative gain values (negative values higher than they set in GUI by 0.01 )
+            if "Nikon Scan" in result['Scanner:Software:Name']:
+                if 'Scanner:Software:MasterGain' in result:
+                    value = result['Scanner:Software:MasterGain']
+                    result['Scanner:Software:MasterGain'] = format(value - 0.01 if value < 0 else value, "g")
+                if 'Scanner:Software:ColorGain' in result:
+                    try:
+                        color_gain = [float(part) for part in result['Scanner:Software:ColorGain'].split()]
+                        result['Scanner:Software:ColorGain'] = ', '.join(format(value - 0.01 if value < 0 else value, "g") for value in color_gain)
+                    except ValueError:
+                        raise ValueError("Error! Can't parse NikonScan:ColorGain value.")        
+
+            #insert AutoExposure parameter (equals True by default)
+            if "Nikon Scan" in result['Scanner:Software:Name']:
+                if 'Scanner:Software:MasterGain' in result:
+                    tmp = {}
+                    for tag_name, value in result.items():
+                        if tag_name == 'Scanner:Software:MasterGain': tmp['Scanner:Software:AutoExposure'] = True
+                        tmp[tag_name] = value
+                    result = tmp
     return result
 
 #Get metadata from a file
 def metadata_get_file(file_path, strip_whitespace = True, encoding = None):
-    if encoding is None: encoding = locale.getpreferredencoding(False)
+    if encoding is None: encoding = metafile_encoding_default
     try:
         result = {}
         with open(file_path, 'r', encoding = encoding) as f:
-            for line in f:
-                if len(line) > 0:                                       #skip empty lines
-                    if line.lstrip().startswith(('#', ';')): continue   #skip comments
-                    if '=' not in line: continue                        #skip lines that are not key=value pairs
-                    key, value = line.split('=', 1)
-                    if strip_whitespace:
-                        key = key.strip()
-                        value = value.strip()
-                    for marker in Marker:
-                        if value == marker.value:
-                            result[key] = marker
-                            continue
-                    try:
-                        result[key] = ast.literal_eval(value)
-                    except (ValueError, SyntaxError):
-                        result[key] = value
+            lines = f.read().splitlines()
+        for line in lines:
+            if '=' not in line: continue                            #skip empty lines and lines that are not key=value pairs
+            key, value = line.split('=', 1)
+            if strip_whitespace:
+                key = key.strip()
+                value = value.strip()
+                if key.startswith(('#', ';')): continue             #skip comments
+            elif line.lstrip().startswith(('#', ';')): continue     #skip comments
+            key = sys.intern(key)                                   #same tag names across files share one string object
+            marker = marker_by_value.get(value)
+            if marker is not None:
+                result[key] = marker
+                continue
+            result[key] = str2literal(value)
         #enable ImageTransform if there are tags from that group and enable value is not set explicitly
         if not 'ImageTransform:Enabled' in result:
             for tag_name in result:
@@ -487,10 +565,9 @@ def metadata_get_file(file_path, strip_whitespace = True, encoding = None):
 #Get metadata from paths
 def metadata_get_path(input_path: Path, base_dir: Path):
     def dto_parse(dto_str):
-        tmp = dto_str.split("@", 1)
-        dt = tmp[0].strip()
-        if len(tmp) > 1 and tmp[1].strip(): dt_offset = tmp[1].strip()
-        else: dt_offset = None
+        dt, _, dt_offset = dto_str.partition("@")
+        dt = dt.strip()
+        dt_offset = dt_offset.strip() or None
         if dt:
             #datetime
             dt = dt.split("-")
@@ -503,10 +580,8 @@ def metadata_get_path(input_path: Path, base_dir: Path):
                 if not (0 <= value <= 99): raise ValueError("Error! Datetime component value (except year) must be 2 digits long.")           
         #timezone offset
         if dt_offset is not None:
-            dt_offset = dt_offset.split("-", 1)
-            for i, value in enumerate(dt_offset):
-                dt_offset[i] = str2int(dt_offset[i])
-            if len(dt_offset) < 2: dt_offset += [0] * (2 - len(dt_offset))
+            dt_offset_hours, separator, dt_offset_minutes = dt_offset.partition("-")
+            dt_offset = [str2int(dt_offset_hours), str2int(dt_offset_minutes) if separator else 0]
             #check values
             if not (-24 <= dt_offset[0] <= 24): raise ValueError("Error! Datetime offset hours must within ±24.")
             if not (0 <= dt_offset[1] <= 59): raise ValueError("Error! Datetime offset minutes must be between 0 and 59.")
@@ -555,217 +630,179 @@ def metadata_get_path(input_path: Path, base_dir: Path):
     file_reldir  = file_relpath.parent
 
     #split original basename and metadata
-    if file_name.find('__') < 0:
+    basename, separator, metadata = file_name.rpartition('__')
+    if not separator:
         #no metadata
         file_id = file_name
         metadata = ""
-    else:
+    elif basename:
         #metadata present
-        basename_metadata = file_name.rsplit('__', 1)
-        if len(basename_metadata[0]) > 0: file_id = basename_metadata[0]
-        metadata = basename_metadata[1]
+        file_id = basename
 
-    #get metadata from input filename
+    #get metadata from input filename (dispatch on single character prefix of each entry)
     metadata = metadata.split('_')
     for entry in metadata:
-    #film identifier and frame number in film: "F<FILM_ID>[-<FRAME_NUM_ON_FILM>]"
-        if entry.startswith('F'):
-            entry_value = entry[1:]
-            film_id_frame = entry_value.rsplit("-", 1)
-            film_id = film_id_frame[0]
-            if len(film_id_frame) > 1:
-                if film_id_frame[1]: film_frame = str2int(film_id_frame[1])
-                else: raise ValueError("Error! Frame number on film value not specified.")
-            continue
-        #film strip identifier and frame number on that strip: "S<STRIP_ID>[-<FRAME_NUM_ON_STRIP>]"
-        if entry.startswith('S'):
-            entry_value = entry[1:]
-            strip_id_frame = entry_value.rsplit("-", 1)
-            strip_id = strip_id_frame[0]
-            if len(strip_id_frame) > 1:
-                if strip_id_frame[1]: strip_frame = str2int(strip_id_frame[1])
-                else: raise ValueError("Error! Frame number on strip value not specified.")
-            continue
-        #image number: "N<IMAGE_NUMBER>"
-        if entry.startswith('N'):
-            entry_value = entry[1:]
-            if entry_value: image_number = str2int(entry_value)
-            else: raise ValueError("Error! Image number value not specified.")
-            continue
-        #document name: "Q<DOCUMENT_NAME>" (use &#95; if you need underscore in a value)
-        if entry.startswith('Q'):
-            document_name = entry[1:].replace('&#95;', '_')
-            continue
-        #image crop: "C<LEFT>[-<TOP>[-<WIDTH>[-<HEIGHT>]]]"
-        if entry.startswith('C'):
-            entry_value = entry[1:]
-            if entry_value:
-                crop = entry_value.split("-")
-                for i, value in enumerate(crop):
-                    crop[i] = str2int(crop[i])
-                for value in crop:
-                    if value < 0: raise ValueError("Error! Crop values can't be negative.")
-            else:
-                raise ValueError("Error! Crop value not specified.")
-            continue
-        #image rotation and flip: "R<ROTATION_CW{ANGLE|90CW|90CCW}>[<FLIP{H|V}>]"
-        if entry.startswith('R'):
-            entry_value = entry[1:]
-            rotate = 0
-            flip = [False, False]
-            if 'H' in entry_value:
-                flip[0] = True
-                entry_value = entry_value.replace('H', '')
-            if 'V' in entry_value:
-                flip[1] = True
-                entry_value = entry_value.replace('V', '')
-            if   entry_value == "90CW":  rotate = 90
-            elif entry_value == "90CCW": rotate = 270
-            else:
-                rotate = str2int(entry_value)
-            continue
-        #image compression: "Z<COMPRESSION_ID>"
-        if entry.startswith('Z'):
-            entry_value = entry[1:]
-            if entry_value: compression = entry_value
-            else: raise ValueError("Error! Comperession identifier not specified.")
-            continue
-        #exposure time: "T<EXPOSURE_TIME{<TIME_IN_SECONDS>|'<DENOMINATOR>}>"
-        if entry.startswith('T'):
-            entry_value = entry[1:]
-            if entry_value:
-                if entry_value.startswith("'"):
-                    #value as fraction denominator (1/x)
-                    exposure_time = -str2int(entry_value[1:])
+        prefix, entry_value = entry[:1], entry[1:]
+        match prefix:
+            #film identifier and frame number in film: "F<FILM_ID>[-<FRAME_NUM_ON_FILM>]"
+            case 'F':
+                film_id, separator, film_frame_str = entry_value.rpartition("-")
+                if separator:
+                    if film_frame_str: film_frame = str2int(film_frame_str)
+                    else: raise ValueError("Error! Frame number on film value not specified.")
                 else:
-                    #value in seconds
-                    exposure_time = str2float(entry_value)
-            else:
-                 raise ValueError("Error! Exposure time value not specified.")
-            continue
-        #aperture: "A<F-NUMBER>"
-        if entry.startswith('A'):
-            entry_value = entry[1:]
-            if entry_value: aperture = str2float(entry_value)
-            else: raise ValueError("Error! Aperture value not specified.")
-            continue
-        #ISO: "I<ISO_VALUE>"
-        if entry.startswith('I'):
-            entry_value = entry[1:]
-            if entry_value: iso = str2int(entry_value)
-            else: raise ValueError("Error! ISO value not specified.")
-            continue
-        #flash: "X<EXIF_FLASH_VALUE_NUMBER>"
-        if entry.startswith('X'):
-            entry_value = entry[1:]
-            if entry_value: flash = str2int(entry_value)
-            else: raise ValueError("Error! Flash value not specified.")
-            continue
-        #exposure mode: "E<EXPOSURE_MODE_NUMBER>"
-        if entry.startswith('E'):
-            entry_value = entry[1:]
-            if entry_value: exposure_mode = str2int(entry_value)
-            else: raise ValueError("Error! Exposure Mode value not specified.")
-            continue
-        #white balance mode: "W<WHITE_BALANCE_MODE_NUMBER>"
-        if entry.startswith('W'):
-            entry_value = entry[1:]
-            if entry_value: white_balance_mode = str2int(entry_value)
-            else: raise ValueError("Error! White Balance Mode value not specified.")
-            continue
-        #orientation: "O<VALUE{<CODE>|90CW|90CCW|180}>"
-        if entry.startswith('O'):
-            entry_value = entry[1:]
-            if entry_value:
-                if   entry_value == "90CW":  orientation = 6
-                elif entry_value == "90CCW": orientation = 8
-                elif entry_value == "180":   orientation = 3
+                    film_id = film_frame_str
+            #film strip identifier and frame number on that strip: "S<STRIP_ID>[-<FRAME_NUM_ON_STRIP>]"
+            case 'S':
+                strip_id, separator, strip_frame_str = entry_value.rpartition("-")
+                if separator:
+                    if strip_frame_str: strip_frame = str2int(strip_frame_str)
+                    else: raise ValueError("Error! Frame number on strip value not specified.")
                 else:
-                    orientation = str2int(entry_value)
-                if not (1 <= orientation <= 8):
-                    raise ValueError("Error! Invalid orientation value.")
-            else: raise ValueError("Error! Orientation value not specified.")
-            continue
-        #lens focal length: "L[<FOCAL_LENGTH>][@<FOCAL_LENGTH_35MM>]"
-        if entry.startswith('L'):
-            entry_value = entry[1:]
-            tmp = entry_value.split("@", 1)
-            if tmp[0]: focal_length = str2int(tmp[0])
-            if len(tmp) > 1 and tmp[1]: focal_length_35mm = str2int(tmp[1])
-            if focal_length is None and focal_length_35mm is None:
-                raise ValueError("Error! Lens focal length value not specified.")
-            continue
-        #camera model and maker: "M[<MODEL>][@<MAKER>]"
-        if entry.startswith('M'):
-            entry_value = entry[1:]
-            camera = entry_value.split("@", 1)
-            if camera[0]: camera_model = camera[0]
-            if len(camera) > 1 and camera[1]: camera_maker = camera[1]
-            continue
-        #datetime of original image being taken + timezone offset: "D<YYYY>[-<MM>[-<DD>[-<hh>[-<mm>[-<ss>[@<tzo_hh>[-<tzo_mm>]]]]]]]"
-        if entry.startswith('D'):
-            entry_value = entry[1:]
-            if entry_value:
-                datetime_original, datetime_original_offset = dto_parse(entry_value)
-            else:
-                raise ValueError("Error! Datetime Original value not specified.")
-            continue
-        #datetime when photo was digitized + timezone offset: "B<YYYY>[-<MM>[-<DD>[-<hh>[-<mm>[-<ss>[@<tzo_hh>[-<tzo_mm>]]]]]]]"
-        if entry.startswith('B'):
-            entry_value = entry[1:]
-            if entry_value:
-                datetime_digitized, datetime_digitized_offset = dto_parse(entry_value)
-            else:
-                raise ValueError("Error! Datetime Digitized value not specified.")
-            continue
-        #GNSS coordinates and altitude: "G<{+|-|N|S}LATITUDE_DEG>,<{+|-|E|W}LONGITUDE_DEG>[,<ALTITUDE_M>]"
-        if entry.startswith('G'):
-            entry_value = entry[1:].replace(' ', '')
-            gnss_location = entry_value.split(",")
-            if (2 <= len(gnss_location) <= 3):
-                gnss_sign = 1
-                if gnss_location[0].startswith('N'):
-                    gnss_location[0] = gnss_location[0][1:]
+                    strip_id = strip_frame_str
+            #image number: "N<IMAGE_NUMBER>"
+            case 'N':
+                if entry_value: image_number = str2int(entry_value)
+                else: raise ValueError("Error! Image number value not specified.")
+            #document name: "Q<DOCUMENT_NAME>" (use &#95; if you need underscore in a value)
+            case 'Q':
+                document_name = entry_value.replace('&#95;', '_')
+            #image crop: "C<LEFT>[-<TOP>[-<WIDTH>[-<HEIGHT>]]]"
+            case 'C':
+                if entry_value:
+                    crop = entry_value.split("-")
+                    for i, value in enumerate(crop):
+                        crop[i] = str2int(crop[i])
+                    for value in crop:
+                        if value < 0: raise ValueError("Error! Crop values can't be negative.")
+                else:
+                    raise ValueError("Error! Crop value not specified.")
+            #image rotation and flip: "R<ROTATION_CW{ANGLE|90CW|90CCW}>[<FLIP{H|V}>]"
+            case 'R':
+                rotate = 0
+                flip = [False, False]
+                if 'H' in entry_value:
+                    flip[0] = True
+                    entry_value = entry_value.replace('H', '')
+                if 'V' in entry_value:
+                    flip[1] = True
+                    entry_value = entry_value.replace('V', '')
+                if   entry_value == "90CW":  rotate = 90
+                elif entry_value == "90CCW": rotate = 270
+                else:
+                    rotate = str2int(entry_value)
+            #image compression: "Z<COMPRESSION_ID>"
+            case 'Z':
+                if entry_value: compression = entry_value
+                else: raise ValueError("Error! Comperession identifier not specified.")
+            #exposure time: "T<EXPOSURE_TIME{<TIME_IN_SECONDS>|'<DENOMINATOR>}>"
+            case 'T':
+                if entry_value:
+                    if entry_value.startswith("'"):
+                        #value as fraction denominator (1/x)
+                        exposure_time = -str2int(entry_value[1:])
+                    else:
+                        #value in seconds
+                        exposure_time = str2float(entry_value)
+                else:
+                     raise ValueError("Error! Exposure time value not specified.")
+            #aperture: "A<F-NUMBER>"
+            case 'A':
+                if entry_value: aperture = str2float(entry_value)
+                else: raise ValueError("Error! Aperture value not specified.")
+            #ISO: "I<ISO_VALUE>"
+            case 'I':
+                if entry_value: iso = str2int(entry_value)
+                else: raise ValueError("Error! ISO value not specified.")
+            #flash: "X<EXIF_FLASH_VALUE_NUMBER>"
+            case 'X':
+                if entry_value: flash = str2int(entry_value)
+                else: raise ValueError("Error! Flash value not specified.")
+            #exposure mode: "E<EXPOSURE_MODE_NUMBER>"
+            case 'E':
+                if entry_value: exposure_mode = str2int(entry_value)
+                else: raise ValueError("Error! Exposure Mode value not specified.")
+            #white balance mode: "W<WHITE_BALANCE_MODE_NUMBER>"
+            case 'W':
+                if entry_value: white_balance_mode = str2int(entry_value)
+                else: raise ValueError("Error! White Balance Mode value not specified.")
+            #orientation: "O<VALUE{<CODE>|90CW|90CCW|180}>"
+            case 'O':
+                if entry_value:
+                    if   entry_value == "90CW":  orientation = 6
+                    elif entry_value == "90CCW": orientation = 8
+                    elif entry_value == "180":   orientation = 3
+                    else:
+                        orientation = str2int(entry_value)
+                    if not (1 <= orientation <= 8):
+                        raise ValueError("Error! Invalid orientation value.")
+                else: raise ValueError("Error! Orientation value not specified.")
+            #lens focal length: "L[<FOCAL_LENGTH>][@<FOCAL_LENGTH_35MM>]"
+            case 'L':
+                focal_length_str, _, focal_length_35mm_str = entry_value.partition("@")
+                if focal_length_str: focal_length = str2int(focal_length_str)
+                if focal_length_35mm_str: focal_length_35mm = str2int(focal_length_35mm_str)
+                if focal_length is None and focal_length_35mm is None:
+                    raise ValueError("Error! Lens focal length value not specified.")
+            #camera model and maker: "M[<MODEL>][@<MAKER>]"
+            case 'M':
+                model, _, maker = entry_value.partition("@")
+                if model: camera_model = model
+                if maker: camera_maker = maker
+            #datetime of original image being taken + timezone offset: "D<YYYY>[-<MM>[-<DD>[-<hh>[-<mm>[-<ss>[@<tzo_hh>[-<tzo_mm>]]]]]]]"
+            case 'D':
+                if entry_value:
+                    datetime_original, datetime_original_offset = dto_parse(entry_value)
+                else:
+                    raise ValueError("Error! Datetime Original value not specified.")
+            #datetime when photo was digitized + timezone offset: "B<YYYY>[-<MM>[-<DD>[-<hh>[-<mm>[-<ss>[@<tzo_hh>[-<tzo_mm>]]]]]]]"
+            case 'B':
+                if entry_value:
+                    datetime_digitized, datetime_digitized_offset = dto_parse(entry_value)
+                else:
+                    raise ValueError("Error! Datetime Digitized value not specified.")
+            #GNSS coordinates and altitude: "G<{+|-|N|S}LATITUDE_DEG>,<{+|-|E|W}LONGITUDE_DEG>[,<ALTITUDE_M>]"
+            case 'G':
+                entry_value = entry_value.replace(' ', '')
+                gnss_location = entry_value.split(",")
+                if (2 <= len(gnss_location) <= 3):
                     gnss_sign = 1
-                elif gnss_location[0].startswith('S'):
-                    gnss_location[0] = gnss_location[0][1:]
-                    gnss_sign = -1
-                gnss_latitude = gnss_sign * str2float(gnss_location[0])
-                gnss_sign = 1
-                if gnss_location[1].startswith('E'):
-                    gnss_location[1] = gnss_location[1][1:]
+                    if gnss_location[0].startswith('N'):
+                        gnss_location[0] = gnss_location[0][1:]
+                        gnss_sign = 1
+                    elif gnss_location[0].startswith('S'):
+                        gnss_location[0] = gnss_location[0][1:]
+                        gnss_sign = -1
+                    gnss_latitude = gnss_sign * str2float(gnss_location[0])
                     gnss_sign = 1
-                elif gnss_location[1].startswith('W'):
-                    gnss_location[1] = gnss_location[1][1:]
-                    gnss_sign = -1
-                gnss_longitude = gnss_sign * str2float(gnss_location[1])
-                if len(gnss_location) > 2:
-                    gnss_altitude = str2float(gnss_location[2])
-            else:
-                raise ValueError("Error! GPS location can't be parsed.")
-            continue
-        #image title "H<IMAGE_TITLE>" (use &#95; if you need underscore in a value)
-        if entry.startswith('H'):
-            image_title = entry[1:].replace('&#95;', '_')
-            continue
-        #image description "N<IMAGE_DESCRIPTION>" (use &#95; if you need underscore in a value)
-        if entry.startswith('N'):
-            image_description = entry[1:].replace('&#95;', '_')
-            continue
-        #user comment: "U<USER_COMMENT>" (use &#95; if you need underscore in a value)
-        if entry.startswith('U'):
-            user_comment = entry[1:].replace('&#95;', '_')
-            continue
-        #raw (key=value pair): "#<TAG_NAME>=<TAG_VALUE>"
-        if entry.startswith('#'):
-            entry_value = entry[1:]
-            if '=' in entry_value:
-                raw_key, raw_value = entry_value.split('=', 1)
-                raw_key = html.unescape(raw_key)
-                raw[raw_key] = raw_value.replace('&#95;', '_')
-            else:
-                raise ValueError("Error! Raw tag can't be parsed.")
-            continue
+                    if gnss_location[1].startswith('E'):
+                        gnss_location[1] = gnss_location[1][1:]
+                        gnss_sign = 1
+                    elif gnss_location[1].startswith('W'):
+                        gnss_location[1] = gnss_location[1][1:]
+                        gnss_sign = -1
+                    gnss_longitude = gnss_sign * str2float(gnss_location[1])
+                    if len(gnss_location) > 2:
+                        gnss_altitude = str2float(gnss_location[2])
+                else:
+                    raise ValueError("Error! GPS location can't be parsed.")
+            #image title "H<IMAGE_TITLE>" (use &#95; if you need underscore in a value)
+            case 'H':
+                image_title = entry_value.replace('&#95;', '_')
+            #image description "K<IMAGE_DESCRIPTION>" (use &#95; if you need underscore in a value)
+            case 'K':
+                image_description = entry_value.replace('&#95;', '_')
+            #user comment: "U<USER_COMMENT>" (use &#95; if you need underscore in a value)
+            case 'U':
+                user_comment = entry_value.replace('&#95;', '_')
+            #raw (key=value pair): "#<TAG_NAME>=<TAG_VALUE>"
+            case '#':
+                raw_key, separator, raw_value = entry_value.partition('=')
+                if separator:
+                    raw_key = html.unescape(raw_key)
+                    raw[raw_key] = raw_value.replace('&#95;', '_')
+                else:
+                    raise ValueError("Error! Raw tag can't be parsed.")
 
     result = {}
     #--- filename
@@ -829,6 +866,16 @@ def metadata_get_path(input_path: Path, base_dir: Path):
 
     return result
 
+#Copy metadata value (lists and dicts are copied at every level, e.g. compression arguments dict inside 'ImageTransform:Compression' is modified by tifffile)
+def metadata_copy_value(value):
+    if isinstance(value, list): return [metadata_copy_value(item) for item in value]
+    if isinstance(value, dict): return {key: metadata_copy_value(item) for key, item in value.items()}
+    return value
+
+#Copy metadata (other values are immutable, so they are shared)
+def metadata_copy(metadata):
+    return {key: metadata_copy_value(value) for key, value in metadata.items()}
+
 #Update existing metadata
 def metadata_update(base, update, allow_new_tags = True):
     for key, value_new in update.items():
@@ -836,13 +883,8 @@ def metadata_update(base, update, allow_new_tags = True):
             if tag_iswritable(key, base):
                 if isinstance(value_new, (list, tuple)) and isinstance(base[key], (list, tuple)):
                     #both values are arrays -> update their elements positionaly
-                    value_old = list(base[key])
-                    for i in range(len(value_new)):
-                        if i < len(value_old):
-                            value_old[i] = value_new[i]
-                        else:
-                            value_old.append(value_new[i])
-                    base[key] = type(base[key])(value_old)  #preserve original type
+                    value_old = base[key]
+                    base[key] = type(value_old)((*value_new, *value_old[len(value_new):]))   #preserve original type (new object, old one may be shared with parent metadata)
                 else:
                     #update value by simple overwrite
                     base[key] = value_new
@@ -850,8 +892,12 @@ def metadata_update(base, update, allow_new_tags = True):
             base[key] = value_new
 
 #Fill metadata tags with values set to AUTO with actual data
-def metadata_autofill(file_path, metadata):
-    if metadata.get('DocumentName') == Marker.AUTO:
+def metadata_autofill(file_path, metadata, messages = None):
+    #tags to fill (collected in one pass, nothing to do if there are none)
+    auto_keys = {tag_name for tag_name, tag_value in metadata.items() if tag_value is Marker.AUTO}
+    if not auto_keys: return
+
+    if 'DocumentName' in auto_keys:
         film_id     = metadata.get('Extra:FilmID')
         film_frame  = metadata.get('Extra:FilmFrameNumber')
         strip_id    = metadata.get('Extra:StripID')
@@ -860,45 +906,42 @@ def metadata_autofill(file_path, metadata):
             metadata['DocumentName'] = f"{film_id}-{film_frame:02d}_S{strip_id}-{strip_frame}"
         else:
             metadata['DocumentName'] = ""
-            print("Warning! Can't assign 'DocumentName', not enough data.")
+            report("Warning! Can't assign 'DocumentName', not enough data.", messages)
 
-    if metadata.get('ModifyDate') == Marker.AUTO:
+    if 'ModifyDate' in auto_keys:
         now = datetime.now().astimezone()
         metadata['ModifyDate'] = now.strftime("%Y:%m:%d %H:%M:%S")
-        if tag_iswritable('OffsetTime', metadata) and metadata['OffsetTime'] == Marker.AUTO:
+        if tag_iswritable('OffsetTime', metadata) and metadata['OffsetTime'] is Marker.AUTO:
             now_offset = now.strftime("%z")
             metadata['OffsetTime'] = now_offset[:3] + ":" + now_offset[3:]
 
-    if metadata.get('ShutterSpeedValue') == Marker.AUTO:
+    if 'ShutterSpeedValue' in auto_keys:
         metadata['ShutterSpeedValue'] = metadata.get('ExposureTime', Marker.SKIP)
 
-    if metadata.get('ApertureValue') == Marker.AUTO:
+    if 'ApertureValue' in auto_keys:
         metadata['ApertureValue'] = metadata.get('FNumber', Marker.SKIP)
 
-    if metadata.get('ExifImageWidth') == Marker.AUTO:
+    autofill_width  = 'ExifImageWidth' in auto_keys
+    autofill_height = 'ExifImageHeight' in auto_keys
+    if autofill_width or autofill_height:
+        #read both dimensions with a single file open
         with tifffile.TiffFile(file_path) as tif:
             page = tif.pages[0]
-            metadata['ExifImageWidth'] = page.imagewidth
+            if autofill_width:  metadata['ExifImageWidth'] = page.imagewidth
+            if autofill_height: metadata['ExifImageHeight'] = page.imagelength
 
-    if metadata.get('ExifImageHeight') == Marker.AUTO:
-        with tifffile.TiffFile(file_path) as tif:
-            page = tif.pages[0]
-            metadata['ExifImageHeight'] = page.imagelength
-
-    if metadata.get('CreateDate') == Marker.AUTO:
-        with exiftool.ExifToolHelper(executable = exiftool_exe) as exif:
-            modify_date = exif.get_tags(file_path, 'ModifyDate')[0]['EXIF:ModifyDate']
-            metadata['CreateDate'] = modify_date.replace('.', ':')
-        if metadata.get('OffsetTimeDigitized') == Marker.AUTO:
+    if 'CreateDate' in auto_keys:
+        modify_date = exiftool_get_helper().get_tags(file_path, 'ModifyDate', params = ['-n'])[0]['EXIF:ModifyDate']
+        metadata['CreateDate'] = modify_date.replace('.', ':')
+        if 'OffsetTimeDigitized' in auto_keys:
             try:
                 dt = datetime.strptime(metadata['CreateDate'], "%Y:%m:%d %H:%M:%S")
-                local_zone = ZoneInfo(get_localzone_name())
-                dtz = dt.replace(tzinfo = local_zone)
+                dtz = dt.replace(tzinfo = timezone_get_local())
                 dtz_offset = dtz.strftime("%z")
                 metadata['OffsetTimeDigitized'] = dtz_offset[:3] + ":" + dtz_offset[3:]
             except ValueError:
                 pass
-    if metadata.get('GPSLatitudeRef') == Marker.AUTO:
+    if 'GPSLatitudeRef' in auto_keys:
         gps_latitude = metadata.get('GPSLatitude')
         if not isinstance(gps_latitude, Marker):
             if isinstance(gps_latitude, str):
@@ -918,7 +961,7 @@ def metadata_autofill(file_path, metadata):
         else:
             metadata['GPSLatitudeRef'] = Marker.SKIP
 
-    if metadata.get('GPSLongitudeRef') == Marker.AUTO:
+    if 'GPSLongitudeRef' in auto_keys:
         gps_longitude = metadata.get('GPSLongitude')
         if not isinstance(gps_longitude, Marker):
             if isinstance(gps_longitude, str):
@@ -938,7 +981,7 @@ def metadata_autofill(file_path, metadata):
         else:
             metadata['GPSLongitudeRef'] = Marker.SKIP
 
-    if metadata.get('GPSAltitudeRef') == Marker.AUTO:
+    if 'GPSAltitudeRef' in auto_keys:
         gps_altitude = metadata.get('GPSAltitude')
         if not isinstance(gps_altitude, Marker):
             if isinstance(gps_altitude, (float, int)):
@@ -952,7 +995,7 @@ def metadata_autofill(file_path, metadata):
         else:
             metadata['GPSAltitudeRef'] = Marker.SKIP
 
-    if metadata.get('GPSProcessingMethod') == Marker.AUTO:
+    if 'GPSProcessingMethod' in auto_keys:
         if not isinstance(metadata.get('GPSLatitude', Marker.SKIP), Marker) and not isinstance(metadata.get('GPSLongitude', Marker.SKIP), Marker):
             metadata['GPSProcessingMethod'] = exif_gps_processingmethod_enum[3]
         else:
@@ -963,62 +1006,79 @@ def metadata_update_imagehistory(metadata):
     image_history = metadata['ImageHistory'].split('^', 2)
     if len(image_history) == 1: image_history.append("")
 
-    #extract ImageHistory group tags into separate dictionary
+    #extract ImageHistory and Scanner group tags into separate dictionaries (in one pass)
     image_history_dict = {}
+    scanner_dict = {}
     for tag_name, tag_value in metadata.items():
+        if isinstance(tag_value, Marker): continue
         if tag_name.startswith('ImageHistory:'):
-            if not isinstance(tag_value, Marker):
-                image_history_dict[tag_name[len('ImageHistory:'):]] = tag_value
-    
-    #add Scanner group to it
-    for tag_name, tag_value in metadata.items():
-        if tag_name.startswith('Scanner:'):
-            if not isinstance(tag_value, Marker):
-                image_history_dict[tag_name] = tag_value
+            image_history_dict[tag_name[13:]] = tag_value   #13 = len('ImageHistory:')
+        elif tag_name.startswith('Scanner:'):
+            scanner_dict[tag_name] = tag_value
+
+    #add Scanner group after ImageHistory group
+    image_history_dict.update(scanner_dict)
 
     metadata['ImageHistory'] = image_history[0] + format_nested_dict(image_history_dict) + image_history[1]
 
+#Update metadata for Panasonic C-(D)325EF camera
+def metadata_update_panasonic_cd325ef(metadata):
+    #flash built-in automatic (set as "Auto, Did not fire" by default)
+    if tag_iswritable('EXIF:Flash', metadata) and isinstance(metadata['EXIF:Flash'], Marker):
+        metadata['EXIF:Flash'] = exif_flash_enum[24]
+
+    #exposure time is fixed to 1/130 seconds
+    exposure_time = "1/130"
+    if tag_iswritable('ExposureTime', metadata): metadata['ExposureTime'] = exposure_time
+    if tag_iswritable('ShutterSpeedValue', metadata): metadata['ShutterSpeedValue'] = exposure_time
+
+    #if flash is fired then aperture F-number is 5.6, otherwise it's 9.0
+    aperture_fnumber = 9.0
+    if 'EXIF:Flash' in metadata and exif_flash_fired(metadata['EXIF:Flash']): aperture_fnumber = 5.6
+    if tag_iswritable('FNumber', metadata): metadata['FNumber'] = aperture_fnumber
+    if tag_iswritable('ApertureValue', metadata): metadata['ApertureValue'] = aperture_fnumber
+
+    #focal length is fixed to 34mm
+    focal_length = 34.0
+    if tag_iswritable('FocalLength', metadata): metadata['FocalLength'] = focal_length
+    if tag_iswritable('FocalLengthIn35mmFormat', metadata): metadata['FocalLengthIn35mmFormat'] = focal_length
+    
+    #lens is built-in
+    if tag_iswritable('LensInfo', metadata): metadata['LensInfo'] = [34.0, 34.0, 5.6, 5.6]
+    if tag_iswritable('LensMake', metadata): metadata['LensMake'] = "Panasonic"
+    if tag_iswritable('LensModel', metadata): metadata['LensModel'] = "Built-in, fixed-focus prime lens (1.3m-inf.)"
+
+#Camera specific metadata updates by (<Make>, <Model>)
+metadata_camera_updates = {
+    ("Panasonic", 'C-D325EF'): metadata_update_panasonic_cd325ef,
+    ("Panasonic", 'C-325EF'):  metadata_update_panasonic_cd325ef,
+}
+
 #Update metadata values based on conditions
 def metadata_update_conditional(metadata):
-    if metadata.get('Make', None) == "Panasonic" and (metadata.get('Model', None) == 'C-D325EF' or metadata.get('Model', None) == 'C-325EF'):
-        #Camera == Panasonic C-(D)325EF
-        #flash built-in automatic (set as "Auto, Did not fire" by default)
-        if tag_iswritable('EXIF:Flash', metadata) and isinstance(metadata['EXIF:Flash'], Marker):
-            metadata['EXIF:Flash'] = exif_flash_enum[24]
-
-        #exposure time is fixed to 1/130 seconds
-        exposure_time = "1/130"
-        if tag_iswritable('ExposureTime', metadata): metadata['ExposureTime'] = exposure_time
-        if tag_iswritable('ShutterSpeedValue', metadata): metadata['ShutterSpeedValue'] = exposure_time
-
-        #if flash is fired then aperture F-number is 5.6, otherwise it's 9.0
-        aperture_fnumber = 9.0
-        if 'EXIF:Flash' in metadata and exif_flash_fired(metadata['EXIF:Flash']): aperture_fnumber = 5.6
-        if tag_iswritable('FNumber', metadata): metadata['FNumber'] = aperture_fnumber
-        if tag_iswritable('ApertureValue', metadata): metadata['ApertureValue'] = aperture_fnumber
-
-        #focal length is fixed to 34mm
-        focal_length = 34.0
-        if tag_iswritable('FocalLength', metadata): metadata['FocalLength'] = focal_length
-        if tag_iswritable('FocalLengthIn35mmFormat', metadata): metadata['FocalLengthIn35mmFormat'] = focal_length
-        
-        #lens is built-in
-        if tag_iswritable('LensInfo', metadata): metadata['LensInfo'] = [34.0, 34.0, 5.6, 5.6]
-        if tag_iswritable('LensMake', metadata): metadata['LensMake'] = "Panasonic"
-        if tag_iswritable('LensModel', metadata): metadata['LensModel'] = "Built-in, fixed-focus prime lens (1.3m-inf.)"
-        
+    make, model = metadata.get('Make', None), metadata.get('Model', None)
+    if isinstance(make, str) and isinstance(model, str):
+        camera_update = metadata_camera_updates.get((make, model))
+        if camera_update is not None: camera_update(metadata)
+
+#Find deepest existing directory of the output path (temporary files are placed there)
+def temp_dir_find(output_path: Path):
+    temp_dir = output_path.resolve()
+    while not temp_dir.exists():
+        temp_dir = temp_dir.parent
+        if temp_dir == temp_dir.parent:
+            raise FileNotFoundError("No part of the output path exists.")
+    return temp_dir
+
 #Process image file
 def process_file(input_path: Path, output_path: Path, metadata: dict, temp_dir: Path = None):
-    #temporary file path
+    messages = []   #warnings are returned with the result and printed by the main process
+    #temporary file path (process id in the name keeps files with the same name processed in parallel apart)
+    temp_name = f"{input_path.stem}.{os.getpid()}.tmp"
     if temp_dir is None:
-        temp_path = output_path.resolve()
-        while not temp_path.exists():
-            temp_path = temp_path.parent
-            if temp_path == temp_path.parent:
-                raise FileNotFoundError("No part of the output path exists.")
-        temp_path = temp_path / input_path.with_suffix('.tmp').name
+        temp_path = temp_dir_find(output_path) / temp_name
     elif temp_dir.is_dir():
-        temp_path = temp_dir / input_path.with_suffix('.tmp').name
+        temp_path = temp_dir / temp_name
     else:
         raise FileNotFoundError("Can't work with temp directory.")
 
@@ -1045,30 +1105,31 @@ def process_file(input_path: Path, output_path: Path, metadata: dict, temp_dir:
             image_transform_compressionargs = None
 
         #perform transformations
-        image = tifffile.imread(input_path)
-        image = image_transform(image, image_transform_crop[0], image_transform_crop[1], image_transform_crop[2], image_transform_crop[3], image_transform_rotate, image_transform_flip[0], image_transform_flip[1])
+        #uncompressed images are memory-mapped, so only the part of the file inside the crop area is read (no full decode)
+        try:
+            image = tifffile.memmap(input_path, mode = 'r')
+        except ValueError:
+            image = tifffile.imread(input_path, maxworkers = tifffile_workers)
+        image = image_transform(image, image_transform_crop[0], image_transform_crop[1], image_transform_crop[2], image_transform_crop[3], image_transform_rotate, image_transform_flip[0], image_transform_flip[1], messages)
         os.makedirs(os.path.dirname(temp_path), exist_ok = True)
-        tifffile.imwrite(temp_path, image, photometric='rgb', compression=image_transform_compression, compressionargs=image_transform_compressionargs)
-
-        #restore original metadata in a new image file
-        with exiftool.ExifTool(executable = exiftool_exe) as exif:
-            icc_profile = exif.execute(*["-icc_profile", "-b", str(input_path)], raw_bytes = True)  #extract ICC profile from original image file
-            icc_file = temp_path.with_suffix(os.path.extsep + 'icc')
-            with open(icc_file, 'wb') as f: f.write(icc_profile)                                    #save the ICC profile to a temporary file
-            args = ['-TagsFromFile', str(input_path), '-All:All']
-            if len(exif.execute('-ImageDescription', str(input_path))) == 0:        args.append('-ImageDescription=')
-            if len(exif.execute('-ComponentsConfiguration', str(input_path))) == 0: args.append('-ComponentsConfiguration=')
-            args.extend(['-overwrite_original', str(temp_path)])
-            exif.execute(*args)
-            exif.execute('-overwrite_original', '-icc_profile<='+ str(icc_file), str(temp_path))    #inject ICC profile from profile temporary file into image temporary file
-            os.remove(icc_file)
+        tifffile.imwrite(temp_path, image, photometric='rgb', compression=image_transform_compression, compressionargs=image_transform_compressionargs, maxworkers=tifffile_workers)
+        del image   #release memory map of the input file
+
+        #restore original metadata in a new image file (ICC profile is an unsafe tag, it's copied only if named explicitly)
+        exif = exiftool_get_helper()
+        source_tags = exif.get_tags(input_path, ['ImageDescription', 'ComponentsConfiguration'])[0]
+        args = ['-n', '-TagsFromFile', os.fspath(input_path), '-All:All', '-ICC_Profile']
+        if not any(tag_name.endswith(':ImageDescription') for tag_name in source_tags):        args.append('-ImageDescription=')
+        if not any(tag_name.endswith(':ComponentsConfiguration') for tag_name in source_tags): args.append('-ComponentsConfiguration=')
+        args.extend(['-overwrite_original', os.fspath(temp_path)])
+        exiftool_write(args, messages)
     else:
         #image tramsformations are not needed, simply copy image file to a new location
         os.makedirs(temp_path.parent, exist_ok = True)
         shutil.copy(input_path, temp_path)
     
     #autofill EXIF data values
-    metadata_autofill(temp_path, metadata)
+    metadata_autofill(temp_path, metadata, messages)
 
     #resolve actual output path and move file there
     output_path = path_build(output_path, metadata)
@@ -1077,25 +1138,25 @@ def process_file(input_path: Path, output_path: Path, metadata: dict, temp_dir:
     shutil.move(temp_path, output_path)
 
     #remove all extra tags from metadata
-    delete_keys_with_prefixes(metadata, ['ImageTransform:', 'Script:', 'Scanner:', 'ImageHistory:', 'Extra:'])
+    delete_keys_with_prefixes(metadata, ('ImageTransform:', 'Script:', 'Scanner:', 'ImageHistory:', 'Extra:'))
 
     #write EXIF data to image file
     args = ['-E', '-overwrite_original']
     for tag_name, tag_value in metadata.items():
-        if tag_value == Marker.DELETE:
-            args.append(f"-{tag_name}=")
-            continue
-        elif tag_value == Marker.SKIP or tag_value == Marker.OPTIONAL:
-            continue
-        elif tag_value == Marker.AUTO:
-            print(f"Warning! '{tag_name}' = <AUTO> after autofill already passed.")
-        elif tag_value == Marker.MANDATORY:
-            raise ValueError(f"Error! Mandatory tag '{tag_name}' value not assigned.")
+        if isinstance(tag_value, Marker):
+            #markers left after autofill (regular values skip this check entirely)
+            if tag_value is Marker.DELETE:
+                args.append(f"-{tag_name}=")
+                continue
+            elif tag_value is Marker.SKIP or tag_value is Marker.OPTIONAL:
+                continue
+            elif tag_value is Marker.AUTO:
+                report(f"Warning! '{tag_name}' = <AUTO> after autofill already passed.", messages)
+            elif tag_value is Marker.MANDATORY:
+                raise ValueError(f"Error! Mandatory tag '{tag_name}' value not assigned.")
 
         if isinstance(tag_value, (list, tuple)):
-            tmp_str = ""
-            for item in tag_value: tmp_str += str(item) + ' '
-            tag_value = tmp_str.strip()
+            tag_value = ' '.join(map(str, tag_value)).strip()
         if isinstance(tag_value, str):
             tag_value = tag_value.replace('\n', '&#xd;&#xa;')
 
@@ -1105,7 +1166,6 @@ def process_file(input_path: Path, output_path: Path, metadata: dict, temp_dir:
             continue
         if tag_name == 'DateTimeOriginal' or tag_name == 'ModifyDate' or tag_name == 'CreateDate':
             #allow syntactically correct but semantically invalid values to datetime tags
-            datetime_regex = re.compile(r"^\d{4}:\d{2}:\d{2} \d{2}:\d{2}:\d{2}$")
             if datetime_regex.match(tag_value):
                 try:
                     datetime.strptime(tag_value, "%Y:%m:%d %H:%M:%S")
@@ -1117,10 +1177,8 @@ def process_file(input_path: Path, output_path: Path, metadata: dict, temp_dir:
         args.append(f'-{tag_name}={tag_value}')
     args.append(output_path)
     
-    command = [exiftool_exe]
-    command.extend(args)
-    subprocess.run(command, encoding = "utf-8", check = True)
-    return output_path
+    result = exiftool_write(args, messages)
+    return output_path, result.strip(), messages
 
 def main():
     #parse call arguments
@@ -1132,14 +1190,17 @@ def main():
     parser.add_argument("--dirdepth", type=int, default=-1, metavar="<int>", help="Max directory depth (-1 for no limit) [default: -1].")
     parser.add_argument("--metafile", type=Path, default=Path("metadata.txt"), metavar="<file>", help="Metadata file name [default: 'metadata.txt'].")
     parser.add_argument("--wildcards", type=str, default="*.tif,*.tiff", metavar="<str>", help="Comma-separated list of file patterns [default: '*.tif,*.tiff'].")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 1) // 2), metavar="<int>", help="Number of worker processes [default: half the number of CPUs].")
     args = parser.parse_args()
 
     wildcards = [w.strip() for w in args.wildcards.split(",")]
+    file_pattern = compile_patterns(wildcards)
     base_dir = args.base_dir.resolve()
     output_path = args.output_path.resolve()
     temp_dir = args.tempdir
     dir_depth = args.dirdepth
     metafile = args.metafile
+    workers = max(1, args.workers)
     exiftool_find(args.exiftool)
 
     #if existing directory is provided as an output, use it as base directory to mirror base directory structure
@@ -1148,11 +1209,12 @@ def main():
 
     #displaying parameters
     print("EXIF-writer by Alexander Taluts.")
-    print(f"    Exiftool        : {exiftool_exe}")
+    print(f"    Exiftool        : {scan_common.exiftool_exe}")
     print(f"    Base directory  : {base_dir}")
     print(f"    Directory depth : {dir_depth}")
     print(f"    Wildcards       : {wildcards}")
     print(f"    Metafile        : {metafile}")
+    print(f"    Workers         : {workers}")
     print(f"    Output          : {output_path}")
     print( "    Temp. directory : ", end="")
     if temp_dir is None: print("<auto>")
@@ -1160,41 +1222,53 @@ def main():
     print("")
 
     print("Processing files...")
-    file_counter = 0
     time_start = time.monotonic()
-    #iterate through directories
-    for root, dirs, files in os.walk(base_dir):
-        current_path = Path(root)
-        depth = len(current_path.relative_to(base_dir).parts)
-        if dir_depth >= 0 and depth > dir_depth:
-            continue    #skip if depth is deeper than being set
-
-        #update metadata from metafiles
-        metadata_dir = copy.deepcopy(metadata_default)
-        if metafile.is_absolute():
-            #path to metafile is absolute -> update metadata from single file
-            if metafile.exists():
-                metadata_update(metadata_dir, metadata_get_file(metafile), not metadata_dir.get('Script:LockTagList', False))
-        else:
-            #path to metafile is relative -> update metadata cumulatively from multiple metafiles
-            path_relparts = current_path.relative_to(base_dir).parts
-            path_chain = [base_dir]
-            for part in path_relparts:
-                path_chain.append(path_chain[-1] / part)
-            for path in path_chain:
-                metafile_cur = path / metafile
+    file_counter = 0
+    input_paths = deque()   #files that are handed out but not printed yet
+
+    #iterate through directories and build metadata of each file just before it is handed out
+    #(bad metafile or file name stops the run at that file, files before it are still processed)
+    def iter_tasks():
+        nonlocal temp_dir
+        #path to metafile is absolute -> the same metadata from single file is used for every directory (read it once)
+        metadata_single = None
+        if metafile.is_absolute() and metafile.exists():
+            metadata_single = metadata_get_file(metafile)
+        #cumulative metadata of visited directories (parents are visited before their subdirectories)
+        metadata_dirs = {}
+        for current_path, _, depth, filenames in iter_dirs(base_dir, file_pattern, dir_depth):
+            #update metadata from metafiles
+            if metafile.is_absolute():
+                #path to metafile is absolute -> update metadata from single file
+                metadata_dir = metadata_copy(metadata_default)
+                if metadata_single is not None:
+                    metadata_update(metadata_dir, metadata_single, not metadata_dir.get('Script:LockTagList', False))
+            else:
+                #path to metafile is relative -> update metadata cumulatively from multiple metafiles (parent directory metadata + own metafile)
+                metadata_parent = metadata_dirs.get(current_path.parent) if depth > 0 else None
+                metadata_dir = metadata_copy(metadata_default if metadata_parent is None else metadata_parent)
+                metafile_cur = current_path / metafile
                 if metafile_cur.exists():
                     metadata_update(metadata_dir, metadata_get_file(metafile_cur), not metadata_dir.get('Script:LockTagList', False))
+                metadata_dirs[current_path] = metadata_dir
 
-        #iterate throught files in current directory
-        for filename in files:
-            if any(fnmatch.fnmatch(filename, pat) for pat in wildcards):
+            #iterate throught files in current directory
+            for filename in filenames:
                 input_path = current_path / filename
-                metadata_file = copy.deepcopy(metadata_dir)
+                metadata_file = metadata_copy(metadata_dir)
                 metadata_update(metadata_file, metadata_get_path(input_path, base_dir), not metadata_dir.get('Script:LockTagList', False)) #get metadata for file from its path
-                file_counter += 1
-                print(f"{file_counter}. {input_path} >> ", end="")
-                process_file(input_path, output_path, metadata_file, temp_dir)
+                #output path template is the same for all files -> find automatic temp directory once, for the first file
+                if temp_dir is None:
+                    temp_dir = temp_dir_find(output_path)
+                input_paths.append(input_path)
+                yield input_path, output_path, metadata_file, temp_dir
+
+    #files are independent -> process them in worker processes, results come back in input order
+    #files are submitted as results are consumed (bounded window), so metadata of next files is built while workers process previous ones
+    with contextlib.closing(run_tasks(process_file, iter_tasks(), workers, init_worker, (scan_common.exiftool_exe,))) as results:
+        for _, message, warnings in results:
+            file_counter += 1
+            print(f"{file_counter}. {input_paths.popleft()} >> {message}" + "".join(f"\n    {warning}" for warning in warnings))
 
     duration = int(time.monotonic() - time_start)
     hours, remainder = divmod(duration, 3600)
@@ -0,0 +1,142 @@
+import sys, os, shutil, fnmatch
+import re
+import atexit
+import multiprocessing.util
+import itertools
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+#Helpers shared by the scripts (keep this file next to them)
+
+#Exiftool path
+exiftool_exe = None
+
+#Keyword arguments of persistent exiftool helper (set by the script at import, e.g. its common arguments)
+exiftool_helper_args = {}
+
+#Persistent exiftool process (-stay_open mode), started on first use
+exiftool_helper = None
+
+#Exiftool executable name and script directory (resolved once)
+exiftool_name = "exiftool.exe" if sys.platform.startswith("win") else "exiftool"
+script_dir = Path(__file__).resolve().parent
+
+#Get exiftool executable name
+def exiftool_getname():
+    return exiftool_name
+
+#Find exiftool
+def exiftool_find(search_list: Path = None):
+    global exiftool_exe
+    #if already resolved -> do nothing
+    if exiftool_exe is not None: return
+
+    if isinstance(search_list, (tuple, list)): search_list = list(search_list)
+    elif isinstance(search_list, Path): search_list = [search_list]
+    else: search_list = []
+
+    #add script directory path to search list
+    search_list.append(script_dir)
+
+    #search in the search list
+    for path in search_list:
+        if path.name != exiftool_name:
+            path = path / exiftool_name
+        if path.is_file():
+            exiftool_exe = str(path)
+            return
+    
+    #search in system PATH
+    path = shutil.which("exiftool")
+    if path:
+        exiftool_exe = path
+        return
+
+    #not found
+    raise FileNotFoundError("ExifTool executable not found in manual path, script directory or system PATH.")
+
+#Get persistent exiftool helper (started on first call, terminated at exit)
+def exiftool_get_helper():
+    global exiftool_helper
+    if exiftool_helper is None:
+        import exiftool     #imported on first use, crop-finder doesn't need pyexiftool at all
+        exiftool_helper = exiftool.ExifToolHelper(executable = exiftool_exe, **exiftool_helper_args)
+        exiftool_helper.run()
+        atexit.register(exiftool_helper.terminate)
+    return exiftool_helper
+
+#Initialize worker process (each worker drives its own persistent exiftool)
+def init_worker(exiftool_path):
+    global exiftool_exe, exiftool_helper
+    exiftool_exe = exiftool_path
+    exiftool_helper = None      #never share exiftool process inherited from parent
+    #atexit handlers are not run in worker processes -> terminate exiftool with multiprocessing finalizer
+    multiprocessing.util.Finalize(None, exiftool_get_helper().terminate, exitpriority = 0)
+
+#Run function over argument tuples, results are yielded in input order
+#tasks go to worker processes only if there are several workers and at least two tasks, otherwise they run in this process
+#tasks are taken lazily (at most 2 * workers in flight), so the caller may still be listing files while workers process earlier ones
+#if taking a task or a task itself fails, tasks already handed out are finished and yielded first, then the error is raised
+def run_tasks(fn, tasks, workers, initializer = None, initargs = ()):
+    tasks = iter(tasks)
+    first_tasks = []
+    try:
+        for task in tasks:
+            first_tasks.append(task)
+            if len(first_tasks) == 2: break
+    except Exception:
+        #taking a task failed before there were two of them -> run the ones already taken, then raise
+        yield from itertools.starmap(fn, first_tasks)
+        raise
+    tasks = itertools.chain(first_tasks, tasks)
+    if workers <= 1 or len(first_tasks) < 2:
+        yield from itertools.starmap(fn, tasks)
+        return
+    executor = ProcessPoolExecutor(max_workers = workers, initializer = initializer, initargs = initargs)
+    futures = deque()
+    try:
+        try:
+            for task in tasks:
+                futures.append(executor.submit(fn, *task))
+                if len(futures) >= 2 * workers:
+                    yield futures.popleft().result()
+        except Exception:
+            while futures:
+                yield futures.popleft().result()
+            raise
+        while futures:
+            yield futures.popleft().result()
+    finally:
+        #don't start queued tasks if processing stopped early
+        executor.shutdown(cancel_futures = True)
+
+
+#Combine all wildcards into one regex, compiled once (names are matched after os.path.normcase, same as fnmatch.fnmatch: case-insensitive on Windows only)
+def compile_patterns(patterns):
+    return re.compile("|".join(fnmatch.translate(os.path.normcase(pattern)) for pattern in patterns) or r"(?!)")
+
+#Walk directory tree top-down with os.scandir (subdirectories deeper than max depth are not entered at all)
+#yields (directory, relative directory, depth, names of matching files)
+def iter_dirs(base_dir: Path, file_pattern, max_depth):
+    def walk(directory, relative_dir, depth):
+        files, subdirs = [], []
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        is_dir = False
+                    if is_dir:
+                        #symlinked directories are not followed (same as os.walk)
+                        if (max_depth < 0 or depth < max_depth) and not entry.is_symlink():
+                            subdirs.append(entry.name)
+                    elif file_pattern.match(os.path.normcase(entry.name)):
+                        files.append(entry.name)
+        except OSError:
+            return  #unreadable directory is skipped (same as os.walk)
+        yield directory, relative_dir, depth, files
+        for name in subdirs:
+            yield from walk(directory / name, relative_dir / name, depth + 1)
+    yield from walk(Path(base_dir), Path(), 0)
@@ -1,125 +1,90 @@
-import sys, argparse
-import os, shutil, fnmatch
+import argparse
+import os
 import csv
-import subprocess, exiftool
+import exiftool
+import contextlib
+from collections import deque
 import time
 from pathlib import Path
-
-#Exiftool path
-exiftool_exe = None
-
-#Get exiftool executable name
-def exiftool_getname():
-    return "exiftool.exe" if sys.platform.startswith("win") else "exiftool"
-
-#Find exiftool
-def exiftool_find(search_list: Path = None):
-    global exiftool_exe
-    #if already resolved -> do nothing
-    if exiftool_exe is not None: return
-
-    if isinstance(search_list, (tuple, list)): pass
-    elif isinstance(search_list, Path): search_list = [search_list]
-    else: search_list = []
-
-    #add script directory path to search list
-    search_list.append(Path(sys.argv[0]).resolve().parent) 
-
-    #search in the search list
-    for path in search_list:
-        if path.name != exiftool_getname():
-            path = path / exiftool_getname()
-        if path.is_file():
-            exiftool_exe = str(path)
-            return
-    
-    #search in system PATH
-    path = shutil.which("exiftool")
-    if path:
-        exiftool_exe = path
-        return
-
-    #not found
-    raise FileNotFoundError("ExifTool executable not found in manual path, script directory or system PATH.")
+import scan_common
+from scan_common import compile_patterns, iter_dirs, exiftool_find, exiftool_get_helper, init_worker, run_tasks
 
 #Format gain value
 def format_gain(value):
     if value == 0: return " 0.00"
     return format(value, "+.2f")
 
-#Get metadata
-def get_metadata(file_path: Path):
+#Get metadata of multiple files (one exiftool request, results are in the same order as files)
+def get_metadata(file_paths):
+    tags = ['EXIF:all', 'NikonScan:all']    #EXIF tags and NikonScanIFD from Nikon MakerNotes (both groups in one request)
+    exif = exiftool_get_helper()
+    try:
+        outputs = exif.get_tags([str(file_path) for file_path in file_paths], tags)
+    except exiftool.exceptions.ExifToolExecuteError:
+        outputs = []    #some file could not be read -> read files one by one below, so the error names the file
+    #match outputs to files by SourceFile, not by position (exiftool writes it with '/' separators on Windows, Path comparison ignores that)
+    outputs = {Path(output['SourceFile']): output for output in outputs if 'SourceFile' in output}
+    results = []
+    for file_path in file_paths:
+        output = outputs.get(Path(file_path))
+        if output is None: output = exif.get_tags(str(file_path), tags)[0]    #missing from batch output -> read file on its own
+        results.append(parse_metadata(output))
+    return results
+
+#Parse metadata of a single file from exiftool output
+def parse_metadata(output):
     result = {}
-    with exiftool.ExifToolHelper(executable = exiftool_exe) as exif:
-        #EXIF tags
-        output = exif.get_tags(str(file_path), ['EXIF:all'])[0]
-        date = output.get('EXIF:ModifyDate', '').split()
-        if len(date) > 1: date = date[0].replace('.', '-') + ' ' + date[1].replace('.', ':')
-        result['Date'] = date
-        result['Scanner'] = output['EXIF:Model']
-        result['Software'] = output['EXIF:Software']
-        result['Width'] = output['EXIF:ImageWidth']
-        result['Height'] = output['EXIF:ImageHeight']
-        result['Resolution'] = output['EXIF:XResolution']
-
-        #NikonScanIFD from Nikon MakerNotes
-        output = exif.get_tags(file_path, 'NikonScan:all')[0]
-        for tag_name, value in output.items():
-            if tag_name == 'SourceFile': continue  #skip this key entirely
-            if tag_name.startswith('MakerNotes:'): tag_name = tag_name[len('MakerNotes:'):]  #remove prefix
-            result[tag_name] = value
-
-        #fix NikonScan bug for negative gain values (negative values higher than they set in GUI by 0.01 )
-        if "Nikon Scan" in result['Software']:
-            if 'MasterGain' in result:
-                value = result['MasterGain']
-                if value < 0: value -= 0.01
-                result['MasterGain'] = format_gain(value)
-            if 'ColorGain' in result:
-                try:
-                    color_gain = [float(part) for part in result['ColorGain'].split()]
-                    tmp = []
-                    for value in color_gain:
-                        if value < 0: value -= 0.01
-                        tmp.append(value)
-                    color_gain = [format_gain(tmp[0]), format_gain(tmp[1]), format_gain(tmp[2])]
-                except ValueError:
-                    color_gain = ['', '', '']
-                
-                #split ColorGain into separate values while maintaining order
-                tmp = {}
-                for key, value in result.items():
-                    if key == 'ColorGain':
-                        tmp['ColorGainR'] = color_gain[0]
-                        tmp['ColorGainG'] = color_gain[1]
-                        tmp['ColorGainB'] = color_gain[2]
-                    else:
-                        tmp[key] = value
-                result = tmp
+    date = output.get('EXIF:ModifyDate', '').split()
+    if len(date) > 1: date = date[0].replace('.', '-') + ' ' + date[1].replace('.', ':')
+    result['Date'] = date
+    result['Scanner'] = output['EXIF:Model']
+    result['Software'] = output['EXIF:Software']
+    result['Width'] = output['EXIF:ImageWidth']
+    result['Height'] = output['EXIF:ImageHeight']
+    result['Resolution'] = output['EXIF:XResolution']
+
+    #NikonScanIFD from Nikon MakerNotes
+    for tag_name, value in output.items():
+        if tag_name.startswith('MakerNotes:'): result[tag_name[len('MakerNotes:'):]] = value  #remove prefix
+
+    #fix NikonScan bug for negative gain values (negative values higher than they set in GUI by 0.01 )
+    if "Nikon Scan" in result['Software']:
+        if 'MasterGain' in result:
+            value = result['MasterGain']
+            if value < 0: value -= 0.01
+            result['MasterGain'] = format_gain(value)
+        if 'ColorGain' in result:
+            try:
+                color_gain = [float(part) for part in result['ColorGain'].split()]
+                tmp = []
+                for value in color_gain:
+                    if value < 0: value -= 0.01
+                    tmp.append(value)
+                color_gain = [format_gain(tmp[0]), format_gain(tmp[1]), format_gain(tmp[2])]
+            except ValueError:
+                color_gain = ['', '', '']
+            
+            #split ColorGain into separate values while maintaining order
+            tmp = {}
+            for key, value in result.items():
+                if key == 'ColorGain':
+                    tmp['ColorGainR'] = color_gain[0]
+                    tmp['ColorGainG'] = color_gain[1]
+                    tmp['ColorGainB'] = color_gain[2]
+                else:
+                    tmp[key] = value
+            result = tmp
     return result
 
-def write_csv(csv_path, data):
-    #find all possible keys (tags) in dictionaries
-    columns = []
-    for item in data:
-        for key in item.keys():
-            if key in columns: continue
-            columns.append(key)
-
-    #bring filename to the first column
-    if 'File' in columns: columns.insert(0, columns.pop(columns.index('File')))
-    
+def write_csv(csv_path, columns, rows):
     try:
-        with open(csv_path, mode="w", newline="") as f:
+        with open(csv_path, mode="w", newline="", buffering=1024*1024) as f:  #large buffer -> few big writes on slow (network) drives
             writer = csv.writer(f, quoting=csv.QUOTE_NONNUMERIC)
             #write CSV header
             writer.writerow(columns)
-            #drite rows
-            for item in data:
-                row = []
-                for column in columns:
-                    row.append(item.get(column, ''))
-                writer.writerow(row)
+            #drite rows (rows collected before the last columns appeared are shorter -> pad them with empty values)
+            padding = ('',) * len(columns)
+            writer.writerows(row + padding[len(row):] for row in rows)
         return "done."
     except Exception as e:
         return f"error: {e}"
@@ -134,13 +99,16 @@ def main():
     parser.add_argument("--wildcards", type=str, default="*.tif,*.tiff", help="Comma-separated list of file patterns [default: '*.tif,*.tiff'].")
     parser.add_argument('--omitdir', action='store_true', help='Omit directory in a file path.')
     parser.add_argument('--cleanname', action='store_true', help='Write only basename as a filename (strip any additional metadata in it)')
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 1) // 2), help="Number of worker processes [default: half the number of CPUs].")
     args = parser.parse_args()
 
     wildcards = [w.strip() for w in args.wildcards.split(",")]
+    file_pattern = compile_patterns(wildcards)
     base_dir = args.base_dir.resolve()
     dir_depth = args.dirdepth
     clean_name = args.cleanname
     omit_dir = args.omitdir
+    workers = max(1, args.workers)
     exiftool_find(args.exiftool)
     if args.output is None:
         output_path = base_dir / 'scandata.csv'
@@ -149,51 +117,63 @@ def main():
 
     #displaying parameters
     print("Scan data lister by Alexander Taluts.")
-    print(f"    Exiftool        : {exiftool_exe}")
+    print(f"    Exiftool        : {scan_common.exiftool_exe}")
     print(f"    Base directory  : {base_dir}")
     print(f"    Directory depth : {dir_depth}")
     print(f"    Wildcards       : {wildcards}")
     print(f"    Output          : {output_path}")
     print(f"    Omit directory  : {omit_dir}")
     print(f"    Clean name      : {clean_name}")
+    print(f"    Workers         : {workers}")
     print("")
 
     print("Processing files...")
     file_counter = 0
     time_start = time.monotonic()
-    data = []
-    #iterate through directories
-    for root, dirs, files in os.walk(base_dir):
-        current_path = Path(root)
-        relative_path = current_path.relative_to(base_dir)
-        depth = len(relative_path.parts)
-        if dir_depth >= 0 and depth > dir_depth:
-            continue    #skip if depth is deeper than being set
-
-        #iterate throught files in current directory
-        for filename in files:
-            if any(fnmatch.fnmatch(filename, pat) for pat in wildcards):
-                input_path = current_path / filename
+    columns = {}    #CSV columns in order of first appearance (dictionary is used as an ordered set)
+    rows = []       #row values in column order
+    batches = deque()   #batches that are handed out but not printed yet (relative directory, files)
+
+    #iterate through directories and yield batches of files as soon as a directory is listed
+    def iter_batches():
+        for current_path, relative_path, depth, filenames in iter_dirs(base_dir, file_pattern, dir_depth):
+            #collect matching files in current directory, their metadata is read in batches
+            input_paths = [current_path / filename for filename in filenames]
+            if not input_paths: continue
+            #split directory into up to <workers> batches, so a single large directory is still spread across workers
+            batch_size = -(-len(input_paths) // workers)
+            for i in range(0, len(input_paths), batch_size):
+                batch = input_paths[i:i + batch_size]
+                batches.append((relative_path, batch))
+                yield (batch,)
+
+    #batches are independent -> read them in worker processes, results come back in input order
+    #batches are submitted as results are consumed (bounded window), so next directories are listed while exiftool works on previous ones
+    with contextlib.closing(run_tasks(get_metadata, iter_batches(), workers, init_worker, (scan_common.exiftool_exe,))) as batch_results:
+        for results in batch_results:
+            relative_path, input_paths = batches.popleft()
+            #iterate throught files in batch
+            for input_path, result in zip(input_paths, results):
                 file_counter += 1
-                print(f"{file_counter}. {input_path}:")
-                result = get_metadata(input_path)
-                print(f"    {result}")
-                print("")
+                print(f"{file_counter}. {input_path}:\n    {result}\n")   #one write per file
                 if isinstance(result, dict):
                     if clean_name:
-                        result['File'] = input_path.stem.split('_')[0] + input_path.suffix
+                        file_name = input_path.stem.split('_')[0] + input_path.suffix
                     else:
-                        result['File'] = input_path.name
+                        file_name = input_path.name
                     if not omit_dir:
-                        result['File'] = relative_path / result['File']
-                    data.append(result)
+                        file_name = relative_path / file_name
+                    #filename is the first column, keep only values of the row (no dictionary per file)
+                    result = {'File': file_name, **result}
+                    columns.update(dict.fromkeys(result))
+                    rows.append(tuple(result.get(column, '') for column in columns))
 
     duration = int(time.monotonic() - time_start)
     hours, remainder = divmod(duration, 3600)
     minutes, seconds = divmod(remainder, 60)
     print(f"Processed {file_counter} files in {hours:02}:{minutes:02}:{seconds:02}.")
     print(f"Writing data into {output_path}: ", end = "")
-    result = write_csv(output_path, data)
+    result = write_csv(output_path, list(columns), rows)
     print(result)
 
 
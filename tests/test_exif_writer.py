@@ -0,0 +1,88 @@
+import sys
+import importlib.util
+from pathlib import Path
+import pytest
+
+#exif-writer.py is a standalone script (not importable by name) -> load it from its path, shared helpers are imported from its directory
+script_dir = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(script_dir))
+script_path = script_dir / "exif-writer.py"
+spec = importlib.util.spec_from_file_location("exif_writer", script_path)
+exif_writer = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(exif_writer)
+
+def test_metadata_get_path_without_metadata():
+    #file names without '__' separator carry no metadata, even if they contain '_' and prefix characters
+    base_dir = Path("/scans")
+    for name in ["IMG_1234.tif", "Scan_001.tif", "F1-2_S3-4.tif"]:
+        metadata = exif_writer.metadata_get_path(base_dir / name, base_dir)
+        assert metadata['Extra:FileID'] == Path(name).stem
+        assert all(key.startswith('Extra:File') for key in metadata)
+
+def test_metadata_get_path_with_metadata():
+    base_dir = Path("/scans")
+    metadata = exif_writer.metadata_get_path(base_dir / "IMG_1234__N5.tif", base_dir)
+    assert metadata['Extra:FileID'] == "IMG_1234"
+    assert metadata['ImageNumber'] == 5
+
+def get_path_metadata(name):
+    base_dir = Path("/scans")
+    return exif_writer.metadata_get_path(base_dir / name, base_dir)
+
+def test_metadata_get_path_basename_split():
+    #only the last '__' separates metadata, file without basename gets no file ID
+    metadata = get_path_metadata("roll__01__N5.tif")
+    assert metadata['Extra:FileID'] == "roll__01"
+    assert metadata['ImageNumber'] == 5
+    metadata = get_path_metadata("__N5.tif")
+    assert 'Extra:FileID' not in metadata
+    assert metadata['ImageNumber'] == 5
+
+def test_metadata_get_path_film_and_strip():
+    metadata = get_path_metadata("a__F12-3_S4-5.tif")
+    assert metadata['Extra:FilmID'] == "12"
+    assert metadata['ReelName'] == "12"
+    assert metadata['Extra:FilmFrameNumber'] == 3
+    assert metadata['ImageNumber'] == 3
+    assert metadata['Extra:StripID'] == "4"
+    assert metadata['Extra:StripFrameNumber'] == 5
+    #frame number is taken after the last '-', identifiers without it have no frame number
+    metadata = get_path_metadata("a__F1-2-3_S7.tif")
+    assert metadata['Extra:FilmID'] == "1-2"
+    assert metadata['Extra:FilmFrameNumber'] == 3
+    assert metadata['Extra:StripID'] == "7"
+    assert 'Extra:StripFrameNumber' not in metadata
+    for name in ["a__F12-.tif", "a__S4-.tif"]:
+        with pytest.raises(ValueError):
+            get_path_metadata(name)
+
+def test_metadata_get_path_focal_length_and_camera():
+    metadata = get_path_metadata("a__L34@50_MModel@Make.tif")
+    assert metadata['FocalLength'] == 34
+    assert metadata['FocalLengthIn35mmFormat'] == 50
+    assert metadata['Model'] == "Model"
+    assert metadata['Make'] == "Make"
+    metadata = get_path_metadata("a__L@50_M@Make.tif")
+    assert 'FocalLength' not in metadata
+    assert metadata['FocalLengthIn35mmFormat'] == 50
+    assert 'Model' not in metadata
+    assert metadata['Make'] == "Make"
+    with pytest.raises(ValueError):
+        get_path_metadata("a__L.tif")
+
+def test_metadata_get_path_datetime():
+    metadata = get_path_metadata("a__D1985-10-26-1-21@m7-30.tif")
+    assert metadata['DateTimeOriginal'] == "1985:10:26 01:21:00"
+    assert metadata['OffsetTimeOriginal'] == "-07:30"
+    metadata = get_path_metadata("a__D2000@3.tif")
+    assert metadata['DateTimeOriginal'] == "2000:00:00 00:00:00"
+    assert metadata['OffsetTimeOriginal'] == "+03:00"
+    metadata = get_path_metadata("a__D1985-10-26.tif")
+    assert 'OffsetTimeOriginal' not in metadata
+
+def test_metadata_get_path_description_and_raw():
+    metadata = get_path_metadata("a__Kdescription&#95;text_#XMP-dc&#58;Subject=a&#95;b.tif")
+    assert metadata['ImageDescription'] == "description_text"
+    assert metadata['XMP-dc:Subject'] == "a_b"
+    with pytest.raises(ValueError):
+        get_path_metadata("a__#Subject.tif")
@@ -1,45 +1,16 @@
-import sys, argparse
-import os, shutil, fnmatch
+import argparse
+import os
 from pathlib import Path
-import subprocess, exiftool
+import subprocess
+import contextlib
+from itertools import repeat
 import time
+import scan_common
+from scan_common import compile_patterns, iter_dirs, exiftool_find, exiftool_get_helper, init_worker, run_tasks
 
-#Exiftool path
-exiftool_exe = None
+#Persistent exiftool helper: exit status is not checked (same as plain exiftool process, errors are reported in the output)
+scan_common.exiftool_helper_args['check_execute'] = False
 
-#Get exiftool executable name
-def exiftool_getname():
-    return "exiftool.exe" if sys.platform.startswith("win") else "exiftool"
-
-#Find exiftool
-def exiftool_find(search_list: Path = None):
-    global exiftool_exe
-    #if already resolved -> do nothing
-    if exiftool_exe is not None: return
-
-    if isinstance(search_list, (tuple, list)): pass
-    elif isinstance(search_list, Path): search_list = [search_list]
-    else: search_list = []
-
-    #add script directory path to search list
-    search_list.append(Path(sys.argv[0]).resolve().parent) 
-
-    #search in the search list
-    for path in search_list:
-        if path.name != exiftool_getname():
-            path = path / exiftool_getname()
-        if path.is_file():
-            exiftool_exe = str(path)
-            return
-    
-    #search in system PATH
-    path = shutil.which("exiftool")
-    if path:
-        exiftool_exe = path
-        return
-
-    #not found
-    raise FileNotFoundError("ExifTool executable not found in manual path, script directory or system PATH.")
 
 #Extract XMP tags into a file
 def xmp_extract(input_path: Path, output_path: Path = None):
@@ -48,15 +19,12 @@ def xmp_extract(input_path: Path, output_path: Path = None):
         output_path = input_path.with_suffix(os.path.extsep + 'xmp')
 
     #save xmp data into a file
-    with exiftool.ExifTool(executable = exiftool_exe) as exif:
-        xmp_data = exif.execute(*["-XMP", "-b", str(input_path)], raw_bytes = True)  #extract XMP data from image file
+    xmp_data = exiftool_get_helper().execute(*["-XMP", "-b", str(input_path)], raw_bytes = True)  #extract XMP data from image file
     if len(xmp_data) > 0:
         output_path.parent.mkdir(parents = True, exist_ok = True)
-        with open(output_path, 'wb') as f:
-            f.write(xmp_data)                                                        #save XMP data to a file
 
-        #remove excess tags from file
-        xmp_lines_in = output_path.read_text(encoding = 'utf-8').splitlines()
+        #remove excess tags (filtered in memory, file is written once)
+        xmp_lines_in = xmp_data.decode('utf-8').splitlines()
         xmp_lines_out = []
         for line in xmp_lines_in:
             if line.startswith("<?xpacket"): continue
@@ -70,14 +38,24 @@ def xmp_extract(input_path: Path, output_path: Path = None):
 #Delete XMP tags
 def xmp_delete(input_path: Path):
     try:
-        with exiftool.ExifTool(executable=exiftool_exe) as exif:
-            exif.execute('-overwrite_original', '-XMP=', str(input_path))
-            return "tag deleted"
+        exiftool_get_helper().execute('-overwrite_original', '-XMP=', str(input_path))
+        return "tag deleted"
     except subprocess.CalledProcessError as e:
         return f"{e.returncode} - {e.output.decode(errors='ignore')}"
     except Exception as e:
         return f"Unexpected error - {e}"
 
+#Process image file (extract and/or delete XMP data), returns result message
+def process_file(input_path: Path, output_path: Path, extract: bool, delete: bool):
+    message = ""
+    if extract:
+        #extract XMP data intop a file
+        message += f" >> {xmp_extract(input_path, output_path)}"
+    if delete:
+        #delete XMP data from source file
+        message += f", {xmp_delete(input_path)}"
+    return message
+
 def main():
     #parse call arguments
     parser = argparse.ArgumentParser(description="Extract xmp tags into a sidecar file.")
@@ -87,9 +65,11 @@ def main():
     parser.add_argument("--exiftool", type=Path, default=None, help="Path to exiftool.")
     parser.add_argument("--dirdepth", type=int, default=-1, help="Max directory depth (-1 for no limit) [default: -1].")
     parser.add_argument("--wildcards", type=str, default="*.tif,*.tiff", help="Comma-separated list of file patterns [default: '*.tif,*.tiff'].")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 1) // 2), help="Number of worker processes [default: half the number of CPUs].")
     args = parser.parse_args()
 
     wildcards = [w.strip() for w in args.wildcards.split(",")]
+    file_pattern = compile_patterns(wildcards)
     base_dir = args.base_dir.resolve()
     dir_depth = args.dirdepth
     exiftool_find(args.exiftool)
@@ -103,10 +83,11 @@ def main():
         extract = True
         output_dir = Path(args.extract).resolve()
     delete = args.delete
+    workers = max(1, args.workers)
 
     #displaying parameters
     print("XMP Extractor by Alexander Taluts.")
-    print(f"    Exiftool        : {exiftool_exe}")
+    print(f"    Exiftool        : {scan_common.exiftool_exe}")
     print(f"    Base directory  : {base_dir}")
     print(f"    Directory depth : {dir_depth}")
     print(f"    Wildcards       : {wildcards}")
@@ -117,36 +98,31 @@ def main():
         extract_str = "False"
     print(f"    Extract         : {extract_str}")
     print(f"    Delete          : {delete}")
+    print(f"    Workers         : {workers}")
     print("")
 
     print("Processing files...")
-    file_counter = 0
     time_start = time.monotonic()
+    input_paths = []
+    output_paths = []
     #iterate through directories
-    for root, dirs, files in os.walk(base_dir):
-        current_path = Path(root)
-        relative_path = current_path.relative_to(base_dir)
-        depth = len(relative_path.parts)
-        if dir_depth >= 0 and depth > dir_depth:
-            continue    #skip if depth is deeper than being set
-
+    for current_path, relative_path, depth, filenames in iter_dirs(base_dir, file_pattern, dir_depth):
+        #output directory mirrors current directory (resolved once per directory)
+        output_dir_cur = None if output_dir is None else output_dir / relative_path
         #iterate throught files in current directory
-        for filename in files:
-            if any(fnmatch.fnmatch(filename, pat) for pat in wildcards):
-                input_path = current_path / filename
-                file_counter += 1
-                print(f"{file_counter}. {input_path}", end="")
-                if extract:
-                    #extract XMP data intop a file
-                    if output_dir is None: output_path = None
-                    else: output_path = (output_dir / relative_path / filename).with_suffix(os.path.extsep + 'xmp')
-                    result = xmp_extract(input_path, output_path)
-                    print(f" >> {result}", end="")
-                if delete:
-                    #delete XMP data from source file
-                    result = xmp_delete(input_path)
-                    print(f", {result}", end="")
-                print("")
+        for filename in filenames:
+            input_path = current_path / filename
+            if output_dir_cur is None: output_path = None
+            else: output_path = output_dir_cur / (os.path.splitext(filename)[0] + os.path.extsep + 'xmp')
+            input_paths.append(input_path)
+            output_paths.append(output_path)
+
+    #files are independent -> process them in worker processes, results come back in input order
+    file_counter = len(input_paths)
+    tasks = zip(input_paths, output_paths, repeat(extract), repeat(delete))
+    with contextlib.closing(run_tasks(process_file, tasks, workers, init_worker, (scan_common.exiftool_exe,))) as results:
+        for i, (input_path, message) in enumerate(zip(input_paths, results), 1):
+            print(f"{i}. {input_path}{message}")
 
     duration = int(time.monotonic() - time_start)
     hours, remainder = divmod(duration, 3600)